@@ -40,6 +40,8 @@ if not exist data\grant_management.db (
     python add_school_name_column.py 2>nul
     echo Ensuring template-based budget structure...
     python migrate_template_row_id.py 2>nul
+    echo Upgrading database schema...
+    python migrate_schema.py 2>nul
     echo Optimizing database for concurrent access...
     python enable_wal.py 2>nul
 )
@@ -4,31 +4,43 @@ Grant Management System - Web Application
 Multi-Tenant with Mandatory Authentication
 """
 
-import json
+import csv
+import glob
+import hashlib
+import io
+import itertools
 import os
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, session
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, send_file, session, make_response, g
 from flask_cors import CORS
-from io import BytesIO
+from werkzeug.http import parse_options_header
 
 # Import authentication modules
-from database import init_database, get_db, log_action, generate_otp, hash_password, create_developer_account
+from database import DATABASE_PATH, init_database, upgrade_schema, get_db, get_read_db, get_pool_stats, log_action, generate_otp, hash_password, create_developer_account
 from auth import login_school, login_developer, require_login, require_developer, get_current_school_id
+import db_session
+from ledger import LedgerSnapshot, get_ledger_snapshot
+from tenant_cache import get_tenant_cache, invalidate_tenant
+from export_cache import get_export_cache
 
 # Import database helpers for multi-tenant data access
 from db_helpers import (
     get_school_settings, save_school_settings,
-    get_school_budget, save_school_budget,
-    get_school_credits, save_school_credit, delete_school_credit,
-    get_school_debits, save_school_debit, update_school_debit, delete_school_debit,
-    get_next_document_number
+    get_school_budget, get_school_budget_item, save_school_budget,
+    get_school_credits, get_school_credits_page, get_school_credited_by_item,
+    iter_school_credits_export, iter_school_debits_export, CREDIT_EXPORT_HEADERS, DEBIT_EXPORT_HEADERS,
+    save_school_credit, delete_school_credit,
+    get_school_item_balance, get_school_data_version,
+    get_school_debits, get_school_debits_page, get_school_debit, get_school_debits_for_documents,
+    save_school_debit, delete_school_debit,
+    assign_debit_document_numbers
 )
 
 # Try to import openpyxl for Excel export
 try:
     import openpyxl
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    from openpyxl.drawing.image import Image as XLImage
     EXCEL_AVAILABLE = True
     print("openpyxl loaded successfully - Excel export enabled")
 except ImportError as e:
@@ -40,12 +52,30 @@ app = Flask(__name__)
 CORS(app)
 app.secret_key = os.urandom(24)
 
-# Initialize database on startup
-if not os.path.exists('data/grant_management.db'):
-    print("🔄 Initializing multi-tenant database...")
-    init_database()
-    create_developer_account()
-    print("✅ Database initialized")
+# Rows per page of the credit and debit registers (?per_page= overrides, up to 500)
+REGISTER_PAGE_SIZE = int(os.environ.get('REGISTER_PAGE_SIZE', '50'))
+
+# One database connection and read snapshot per request
+db_session.init_app(app)
+
+def setup_database():
+    """Create the database on first run, otherwise bring its schema up to date.
+
+    Run once before the app serves requests (python app.py, or
+    `flask --app app init-db` ahead of gunicorn), never on import.
+    """
+    if not os.path.exists(DATABASE_PATH):
+        print("🔄 Initializing multi-tenant database...")
+        init_database()
+        create_developer_account()
+        print("✅ Database initialized")
+    else:
+        upgrade_schema()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database"""
+    setup_database()
 
 # Data storage
 # Data directory for legacy support
@@ -97,6 +127,45 @@ def get_credits(financial_year):
         return []
     return get_school_credits(school_id, financial_year)
 
+def get_credited_by_item(financial_year):
+    """Total credited per budget item ({item_id: amount}) for current school"""
+    school_id = get_current_school_id()
+    if not school_id:
+        return {}
+    return get_school_credited_by_item(school_id, financial_year)
+
+def _parse_register_cursor(value):
+    """'<date>_<id>' from a pager link -> (date, id), None if absent or invalid"""
+    if not value:
+        return None
+    date, _, row_id = value.rpartition('_')
+    if not date or not row_id.isdigit():
+        return None
+    return date, int(row_id)
+
+def get_register_page(read_page, financial_year):
+    """Page of a register selected by the request's before/after/per_page args.
+
+    Returns the rows and a pager with the neighbouring pages' cursors.
+    """
+    school_id = get_current_school_id()
+    try:
+        per_page = min(max(int(request.args.get('per_page', REGISTER_PAGE_SIZE)), 1), 500)
+    except ValueError:
+        per_page = REGISTER_PAGE_SIZE
+    if not school_id:
+        return [], {'older': None, 'newer': None, 'per_page': per_page}
+    
+    before = _parse_register_cursor(request.args.get('before'))
+    after = None if before else _parse_register_cursor(request.args.get('after'))
+    page = read_page(school_id, financial_year, per_page, before, after)
+    cursor_arg = lambda key: f"{key[0]}_{key[1]}" if key else None
+    return page['rows'], {
+        'older': cursor_arg(page['older']),
+        'newer': cursor_arg(page['newer']),
+        'per_page': per_page
+    }
+
 def get_settings():
     """Get system settings for current school and financial year"""
     school_id = get_current_school_id()
@@ -174,7 +243,11 @@ def save_credit(credit_data):
     if not school_id:
         return False
     financial_year = credit_data.get('financialYear', get_financial_year())
-    return save_school_credit(school_id, financial_year, credit_data)
+    credit_id = save_school_credit(school_id, financial_year, credit_data)
+    if credit_id:
+        credit_data['id'] = f"credit_{credit_id}"
+        return True
+    return False
 
 def get_debits(financial_year):
     """Get debits for specific school and financial year"""
@@ -183,6 +256,33 @@ def get_debits(financial_year):
         return []
     return get_school_debits(school_id, financial_year)
 
+def get_document_debit(financial_year, debit_id):
+    """A debit and the budget header its printed documents show.
+
+    Reads only the one debit and the budget item it is charged to; the
+    returned budget carries the financial year and school name, not the
+    budget items. The debit is None if the school has no such debit.
+    """
+    budget = get_document_header(financial_year)
+    school_id = get_current_school_id()
+    if not school_id:
+        return None, budget
+    debit = get_school_debit(school_id, financial_year, debit_id)
+    if debit and debit.get('itemId'):
+        add_item_details(debit, get_school_budget_item(school_id, financial_year, debit['itemId']))
+    return debit, budget
+
+def get_document_header(financial_year):
+    """The budget fields printed on GP10s, loose minutes and receipts"""
+    return {'financialYear': financial_year, 'schoolName': session.get('school_name', '')}
+
+def add_item_details(debit, item):
+    """Fill in a debit's code and description from its budget item"""
+    if item:
+        debit['code'] = debit.get('code') or item['code']
+        debit['subItemDescription'] = debit.get('subItemDescription') or item['subItemDescription']
+        debit['powName'] = item['powName']
+
 def save_debit(debit_data):
     """Save debit for current school"""
     school_id = get_current_school_id()
@@ -195,30 +295,111 @@ def save_debit(debit_data):
         return True
     return False
 
-def calculate_spending(budget, debits):
-    """Calculate spending for budget items"""
-    if not budget:
-        return []
-    
-    items = []
-    for budget_item in budget.get('items', []):
-        item_id = budget_item.get('id')
-        item_debits = [d for d in debits if d.get('itemId') == item_id]
-        spent = sum(d.get('amount', 0) for d in item_debits)
-        
-        items.append({
-            'id': item_id,
-            'powNo': budget_item.get('powNo'),
-            'powName': budget_item.get('powName'),
-            'subActivity': budget_item.get('subActivity'),
-            'subItemDescription': budget_item.get('subItemDescription'),
-            'code': budget_item.get('code'),
-            'totalAllocation': budget_item.get('totalAllocation', 0),
-            'spent': spent,
-            'balance': budget_item.get('totalAllocation', 0) - spent
-        })
-    
-    return items
+def get_ledger(financial_year):
+    """Ledger snapshot (per-item, POW, month and grand totals) for current school"""
+    school_id = get_current_school_id()
+    if not school_id:
+        return LedgerSnapshot.empty(financial_year)
+    return get_ledger_snapshot(school_id, financial_year)
+
+# ============================================================================
+# CONDITIONAL GET (ETag / Last-Modified per school data version)
+# ============================================================================
+
+# Changes whenever the code or templates that render the pages change: every
+# module next to app.py (db_helpers, ledger, excel_export, ...) and template
+PAGE_BUILD = max(os.path.getmtime(path) for path in
+                 glob.glob(os.path.join(app.root_path, '*.py')) +
+                 glob.glob(os.path.join(app.root_path, 'templates', '*.html')))
+
+def conditional_get(*kinds):
+    """Answer 304 Not Modified while the school's data the page shows is unchanged.
+
+    The ETag covers the page URL with its query, the versions of the kinds
+    of data the page reads, the financial year and the logged-in user.
+    Last-Modified is only sent once the second of the last change has
+    passed, so a later change can never fall in the same second.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            school_id = get_current_school_id()
+            if not school_id:
+                return view(*args, **kwargs)
+            version = get_school_data_version(school_id, kinds)
+            etag = hashlib.sha1(repr((
+                PAGE_BUILD, request.full_path, school_id, get_financial_year(),
+                sorted(session['user'].items()), session.get('school_name'),
+                version['versions']
+            )).encode()).hexdigest()
+            last_modified = None
+            if version['updatedAt'] is not None:
+                changed = max(version['updatedAt'], PAGE_BUILD)
+                if int(changed) + 1 <= time.time():
+                    last_modified = datetime.fromtimestamp(int(changed) + 1, timezone.utc)
+            
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+            
+            g.page_etag = etag
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code not in (200, 304):
+                return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+def cached_export(*kinds):
+    """Serve an export file from the export cache while the kinds of school
+    data it is built from are unchanged.
+
+    On a miss the view's response is written to the cache and both hits and
+    misses are sent from the cached file, so byte ranges can be requested.
+    A file evicted by another worker before it is opened is built again.
+    Goes inside conditional_get, whose ETag the file is sent with.
+    """
+    def send(path):
+        return send_file(path, as_attachment=True, download_name=os.path.basename(path),
+                         etag=g.get('page_etag', True))
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_export_cache()
+            school_id = get_current_school_id()
+            if not cache.enabled or not school_id:
+                return view(*args, **kwargs)
+            key = (PAGE_BUILD, request.full_path, school_id, get_financial_year(),
+                   get_school_data_version(school_id, kinds)['versions'])
+            path = cache.get(key)
+            if path is not None:
+                try:
+                    return send(path)
+                except FileNotFoundError:
+                    pass
+
+            response = make_response(view(*args, **kwargs))
+            _, options = parse_options_header(response.headers.get('Content-Disposition', ''))
+            if response.status_code != 200 or 'filename' not in options:
+                return response
+            try:
+                path = cache.put(key, options['filename'], response.iter_encoded())
+            finally:
+                response.close()
+            try:
+                return send(path)
+            except FileNotFoundError:
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
 
 def generate_budget_structure():
     """Master template for Malawi Grant Management - 43 rows across 16 POWs"""
@@ -295,40 +476,10 @@ def generate_budget_structure():
     
     return template
 
-def get_available_funds(financial_year):
-    """Calculate available funds per budget item (Credits - Debits)"""
-    budget = get_budget(financial_year)
-    credits = get_credits(financial_year)
-    debits = get_debits(financial_year)
-    
-    available = {}
-    if budget:
-        for item in budget.get('items', []):
-            item_id = item.get('id')
-            # Sum credits for this item using a generator expression
-            item_credits = sum(
-                float(li.get('amount', 0))
-                for c in credits
-                for li in c.get('lineItems', [])
-                if li.get('itemId') == item_id
-            )
-            
-            # Sum debits for this item
-            item_debits = sum(float(d.get('amount', 0)) for d in debits if d.get('itemId') == item_id)
-            
-            available[item_id] = {
-                'budgeted': item.get('totalAllocation', 0),
-                'credited': item_credits,
-                'spent': item_debits,
-                'balance': item_credits - item_debits
-            }
-    return available
-
-
 def get_developer_stats():
     """Get developer dashboard statistics with safe defaults"""
     try:
-        with get_db() as conn:
+        with get_read_db() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) as total FROM schools WHERE school_name != 'DEVELOPER_ACCOUNT'")
             total_schools = cursor.fetchone()['total']
@@ -407,7 +558,7 @@ def logout():
 @require_developer
 def dev_dashboard():
     """Developer dashboard"""
-    with get_db() as conn:
+    with get_read_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, school_name, username, is_active, is_locked, 
@@ -457,19 +608,19 @@ def dev_add_school():
             for item in budget_structure:
                 cursor.execute('''INSERT INTO budget_items
                     (school_id, financial_year, template_row_id, item_key, pow_no, pow_name, sub_activity,
-                     sub_item_description, code, total_allocation, monthly_allocations)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     sub_item_description, code, total_allocation)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (school_id, financial_year, item['template_row_id'], item['id'],
                      item['powNo'], item['powName'], item['subActivity'],
-                     item['subItemDescription'], item['code'],
-                     0, json.dumps(item.get('monthlyAllocations', {}))))
-            
-            try:
-                log_action('DEVELOPER', session['user']['username'], 
-                          f'ADD_SCHOOL: {school_name} (30-day trial, budget initialized)', 
-                          school_id, request.remote_addr)
-            except Exception as log_error:
-                print(f"Error logging action: {log_error}")
+                     item['subItemDescription'], item['code'], 0))
+        
+        # Log after the write transaction has committed
+        try:
+            log_action('DEVELOPER', session['user']['username'], 
+                      f'ADD_SCHOOL: {school_name} (30-day trial, budget initialized)', 
+                      school_id, request.remote_addr)
+        except Exception as log_error:
+            print(f"Error logging action: {log_error}")
     except Exception as e:
         print(f"Error adding school: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -485,7 +636,7 @@ def dev_reset_password(school_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('INSERT INTO password_reset_tokens (school_id, otp_code, expires_at) VALUES (?, ?, ?)', (school_id, otp, expires_at))
-        log_action('DEVELOPER', session['user']['username'], 'RESET_PASSWORD', school_id, request.remote_addr)
+    log_action('DEVELOPER', session['user']['username'], 'RESET_PASSWORD', school_id, request.remote_addr)
     return jsonify({'success': True, 'otp': otp})
 
 @app.route('/dev/lock-school/<int:school_id>', methods=['POST'])
@@ -495,7 +646,7 @@ def dev_lock_school(school_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('UPDATE schools SET is_locked = 1 WHERE id = ?', (school_id,))
-        log_action('DEVELOPER', session['user']['username'], 'LOCK_SCHOOL', school_id, request.remote_addr)
+    log_action('DEVELOPER', session['user']['username'], 'LOCK_SCHOOL', school_id, request.remote_addr)
     return jsonify({'success': True})
 
 @app.route('/dev/unlock-school/<int:school_id>', methods=['POST'])
@@ -505,7 +656,7 @@ def dev_unlock_school(school_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('UPDATE schools SET is_locked = 0 WHERE id = ?', (school_id,))
-        log_action('DEVELOPER', session['user']['username'], 'UNLOCK_SCHOOL', school_id, request.remote_addr)
+    log_action('DEVELOPER', session['user']['username'], 'UNLOCK_SCHOOL', school_id, request.remote_addr)
     return jsonify({'success': True})
 
 @app.route('/dev/send-message/<int:school_id>', methods=['POST'])
@@ -517,7 +668,7 @@ def dev_send_message(school_id):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('INSERT INTO subscription_messages (school_id, message, message_type) VALUES (?, ?, ?)', (school_id, message, 'INFO'))
-        log_action('DEVELOPER', session['user']['username'], 'SEND_MESSAGE', school_id, request.remote_addr)
+    log_action('DEVELOPER', session['user']['username'], 'SEND_MESSAGE', school_id, request.remote_addr)
     return jsonify({'success': True})
 
 @app.route('/dev/delete-school/<int:school_id>', methods=['POST'])
@@ -536,14 +687,21 @@ def dev_delete_school(school_id):
             # Delete all school data
             cursor.execute('DELETE FROM school_settings WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM budget_items WHERE school_id = ?', (school_id,))
+            cursor.execute('DELETE FROM credit_line_items WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM credits WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM debits WHERE school_id = ?', (school_id,))
+            cursor.execute('DELETE FROM budget_item_balances WHERE school_id = ?', (school_id,))
+            cursor.execute('DELETE FROM monthly_summary WHERE school_id = ?', (school_id,))
+            cursor.execute('DELETE FROM document_sequences WHERE school_id = ?', (school_id,))
+            # Other workers drop their cached reads when the versions disappear
+            cursor.execute('DELETE FROM tenant_versions WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM school_sessions WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM subscription_messages WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM password_reset_tokens WHERE school_id = ?', (school_id,))
             cursor.execute('DELETE FROM schools WHERE id = ?', (school_id,))
-            
-            log_action('DEVELOPER', session['user']['username'], f'DELETE_SCHOOL: {school_name}', school_id, request.remote_addr)
+        invalidate_tenant(school_id)
+        
+        log_action('DEVELOPER', session['user']['username'], f'DELETE_SCHOOL: {school_name}', school_id, request.remote_addr)
         
         return jsonify({'success': True, 'message': f'School {school_name} deleted successfully'})
     except Exception as e:
@@ -573,127 +731,90 @@ def dev_update_subscription(school_id):
                     subscription_end = ?
                 WHERE id = ?''',
                 (payment_date, expiry_date.strftime('%Y-%m-%d'), school_id))
-            
-            log_action('DEVELOPER', session['user']['username'], 
-                      f'UPDATE_SUBSCRIPTION: {subscription_days} days, MWK {amount_paid:,.2f}', 
-                      school_id, request.remote_addr)
+        
+        log_action('DEVELOPER', session['user']['username'], 
+                  f'UPDATE_SUBSCRIPTION: {subscription_days} days, MWK {amount_paid:,.2f}', 
+                  school_id, request.remote_addr)
         
         return jsonify({'success': True, 'expiry_date': expiry_date.strftime('%Y-%m-%d')})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/dev/db-stats')
+@require_developer
+def dev_db_stats():
+    """Connection pool, tenant cache and export cache statistics for this worker process"""
+    return jsonify({'success': True, 'pool': get_pool_stats(),
+                    'tenant_cache': get_tenant_cache().stats(),
+                    'export_cache': get_export_cache().stats()})
+
+@app.route('/dev/district-export', methods=['POST'])
+@require_developer
+def dev_district_export():
+    """Start a budget-versus-actual workbook across all schools for a financial year"""
+    import district_export
+    data = request.get_json(silent=True) or {}
+    financial_year = data.get('financialYear') or get_financial_year()
+    with get_read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, school_name FROM schools
+            WHERE school_name != 'DEVELOPER_ACCOUNT'
+            ORDER BY school_name
+        ''')
+        schools = [(row['id'], row['school_name']) for row in cursor.fetchall()]
+    if not schools:
+        return jsonify({'success': False, 'error': 'No schools to export'}), 400
+    job_id = district_export.start_export(financial_year, schools)
+    return jsonify({'success': True, 'job': job_id, 'total': len(schools)})
+
+@app.route('/dev/district-export/<job_id>')
+@require_developer
+def dev_district_export_status(job_id):
+    """Progress of a district export (schools done of total)"""
+    import district_export
+    status = district_export.get_job(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Export not found'}), 404
+    return jsonify({'success': True, **status})
+
+@app.route('/dev/district-export/<job_id>/download')
+@require_developer
+def dev_district_export_download(job_id):
+    """Download a finished district export"""
+    import district_export
+    path = district_export.job_file(job_id)
+    if path is None:
+        return "Export not found or not finished", 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
 @app.route('/grant-summary')
 @require_login
+@conditional_get('settings', 'budget', 'credits', 'debits')
 def grant_summary():
     """Grant Summary dashboard"""
     financial_year = get_financial_year()
     budget = get_budget(financial_year)
-    credits = get_credits(financial_year) or []
-    debits = get_debits(financial_year) or []
-    spending = calculate_spending(budget, debits)
+    ledger = get_ledger(financial_year)
     
     # Get total grant from settings instead of budget
     total_grant = get_total_grant(financial_year)
     
-    total_budgeted = 0.0
-    if budget and budget.get('items'):
-        for item in budget.get('items', []):
-            if isinstance(item, dict):
-                alloc = item.get('totalAllocation', 0)
-                if alloc is not None:
-                    try:
-                        total_budgeted += float(alloc)
-                    except (ValueError, TypeError):
-                        pass
-    
-    total_spent = 0.0
-    for d in debits:
-        if isinstance(d, dict):
-            amt = d.get('amount', 0)
-            if amt is not None:
-                try:
-                    total_spent += float(amt)
-                except (ValueError, TypeError):
-                    pass
-    
-    total_credited = 0.0
-    for c in credits:
-        if isinstance(c, dict):
-            line_items = c.get('lineItems', [])
-            if line_items:
-                for li in line_items:
-                    if isinstance(li, dict):
-                        amt = li.get('amount', 0)
-                        if amt is not None:
-                            try:
-                                total_credited += float(amt)
-                            except (ValueError, TypeError):
-                                pass
-    
-    # Monthly data for charts
+    # Month labels for charts (monthly totals come from the ledger)
     months = ["Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec", "Jan", "Feb", "Mar"]
-    monthly_credits = [0] * 12
-    monthly_debits = [0] * 12
-    
-    month_map = {"April": 0, "May": 1, "June": 2, "July": 3, "August": 4, "September": 5,
-                 "October": 6, "November": 7, "December": 8, "January": 9, "February": 10, "March": 11}
-    
-    for c in credits:
-        if isinstance(c, dict):
-            month = c.get('month')
-            if month in month_map:
-                for li in c.get('lineItems', []):
-                    if isinstance(li, dict):
-                        amt = li.get('amount', 0)
-                        if amt:
-                            try:
-                                monthly_credits[month_map[month]] += float(amt)
-                            except (ValueError, TypeError):
-                                pass
-    
-    for d in debits:
-        if isinstance(d, dict):
-            month = d.get('month')
-            if month in month_map:
-                amt = d.get('amount', 0)
-                if amt:
-                    try:
-                        monthly_debits[month_map[month]] += float(amt)
-                    except (ValueError, TypeError):
-                        pass
-    
-    # Recent transactions for charts
-    recent_credits_data = []
-    for c in credits[-10:]:
-        if isinstance(c, dict):
-            total = sum(float(li.get('amount', 0)) for li in c.get('lineItems', []) if isinstance(li, dict))
-            recent_credits_data.append({'date': c.get('date', ''), 'amount': total})
-    
-    recent_debits_data = []
-    for d in debits[-10:]:
-        if isinstance(d, dict):
-            recent_debits_data.append({'date': d.get('date', ''), 'amount': float(d.get('amount', 0))})
     
     return render_template('grant_summary.html', 
                       budget=budget,
-                      credits=credits,
-                      debits=debits,
-                      spending=spending,
+                      ledger=ledger,
                       total_grant=total_grant,
-                      total_budgeted=total_budgeted,
-                      total_spent=total_spent,
-                      total_credited=total_credited,
                       financial_year=financial_year,
                       settings=get_settings(),
                       current_page='dashboard',
-                      months=months,
-                      monthly_credits=monthly_credits,
-                      monthly_debits=monthly_debits,
-                      recent_credits_data=recent_credits_data,
-                      recent_debits_data=recent_debits_data)
+                      months=months)
 
 @app.route('/budget')
 @require_login
+@conditional_get('settings', 'budget', 'credits', 'debits')
 def budget():
     """Budget allocation page - no self-healing, template is immutable"""
     school_id = get_current_school_id()
@@ -716,13 +837,16 @@ def budget():
 
 @app.route('/export_budget_excel')
 @require_login
+@conditional_get('settings', 'budget')
+@cached_export('settings', 'budget')
 def export_budget_excel():
     """Export Budget Allocation to Excel"""
     # Runtime check for openpyxl
     try:
-        import openpyxl
+        import excel_export
     except ImportError:
         return "Excel export not available. Please install openpyxl: pip install openpyxl==3.1.2", 500
+    from excel_export import cell, styled_row
     
     financial_year = get_financial_year()
     budget = get_budget(financial_year)
@@ -731,132 +855,133 @@ def export_budget_excel():
     if not budget:
         return "No budget found", 404
     
-    # Create workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Budget Allocation"
+    months = ["April", "May", "June", "July", "August", "September", 
+              "October", "November", "December", "January", "February", "March"]
+    headers = ['POW No', 'POW Name', 'Sub Activity', 'Sub Item Description', 'Code', 'Annual Allocation'] + months + ['Total Budgeted', 'Balance']
     
-    # Styles
-    header_fill = PatternFill(start_color="1F2937", end_color="1F2937", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True, size=10)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    wb = excel_export.new_workbook()
+    ws = excel_export.new_sheet(wb, "Budget Allocation", [8, 35, 30, 40, 12, 12] + [10] * 12 + [12, 12])
     
-    # Add centered logo at top
-    try:
-        logo_path = os.path.join('static', 'images', 'Malawi Government logo.png')
-        if os.path.exists(logo_path):
-            img = XLImage(logo_path)
-            img.height = 60
-            img.width = 60
-            # Center the logo (column J is approximately center for 20 columns)
-            ws.add_image(img, 'J1')
-    except Exception as e:
-        print(f"Could not add logo: {e}")
+    # Centered logo at top (column J is approximately center for 20 columns)
+    excel_export.add_logo(ws, 'J1')
+    for _ in range(3):
+        ws.append([])
     
     # Title (below logo)
-    ws.merge_cells('A4:T4')
-    ws['A4'] = 'BUDGET ALLOCATION'
-    ws['A4'].font = Font(bold=True, size=14)
-    ws['A4'].alignment = center_align
-    
-    ws.merge_cells('A5:T5')
-    ws['A5'] = f"{settings.get('ministry', 'NANJATI CDSS')} | Financial Year: {financial_year}"
-    ws['A5'].font = Font(size=10)
-    ws['A5'].alignment = center_align
+    ws.merged_cells.add('A4:T4')
+    ws.append([cell(ws, 'BUDGET ALLOCATION', 'title')])
+    ws.merged_cells.add('A5:T5')
+    ws.append([cell(ws, f"{settings.get('ministry', 'NANJATI CDSS')} | Financial Year: {financial_year}", 'subtitle')])
+    ws.append([])
     
     # Headers (row 7)
-    months = ["April", "May", "June", "July", "August", "September", 
-              "October", "November", "December", "January", "February", "March"]
-    
-    headers = ['POW No', 'POW Name', 'Sub Activity', 'Sub Item Description', 'Code', 'Annual Allocation'] + months + ['Total Budgeted', 'Balance']
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=7, column=col_num, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.border = border
-        cell.alignment = center_align
+    ws.append(styled_row(ws, headers, 'header'))
     
     # Data rows (starting from row 8)
     row_num = 8
     for item in budget.get('items', []):
-        ws.cell(row=row_num, column=1, value=item.get('powNo'))
-        ws.cell(row=row_num, column=2, value=item.get('powName'))
-        ws.cell(row=row_num, column=3, value=item.get('subActivity'))
-        ws.cell(row=row_num, column=4, value=item.get('subItemDescription'))
-        ws.cell(row=row_num, column=5, value=item.get('code'))
-        ws.cell(row=row_num, column=6, value=item.get('totalAllocation', 0))
-        
-        # Monthly allocations
+        # Monthly allocations (row total is summed by SQLite)
         monthly_allocs = item.get('monthlyAllocations', {})
-        col_num = 7
-        total_budgeted = 0
-        for month in months:
-            value = monthly_allocs.get(month, 0)
-            ws.cell(row=row_num, column=col_num, value=value)
-            total_budgeted += value
-            col_num += 1
-        
-        # Total Budgeted
-        ws.cell(row=row_num, column=19, value=total_budgeted)
-        
-        # Balance
+        total_budgeted = item.get('monthlyTotal', 0)
         balance = item.get('totalAllocation', 0) - total_budgeted
-        ws.cell(row=row_num, column=20, value=balance)
-        
-        # Apply borders and alignment
-        for col in range(1, 21):
-            cell = ws.cell(row=row_num, column=col)
-            cell.border = border
-            if col >= 6:  # Numeric columns
-                cell.alignment = Alignment(horizontal='right')
-        
+        ws.append(
+            styled_row(ws, [item.get('powNo'), item.get('powName'), item.get('subActivity'),
+                            item.get('subItemDescription'), item.get('code')], 'text') +
+            styled_row(ws, [item.get('totalAllocation', 0)] +
+                       [monthly_allocs.get(month, 0) for month in months] +
+                       [total_budgeted, balance], 'number')
+        )
         row_num += 1
     
     # Grand totals
-    ws.cell(row=row_num, column=4, value='GRAND TOTALS (POW 1-16):')
-    ws.cell(row=row_num, column=4).font = Font(bold=True)
-    
-    # Calculate totals
+    totals = [None, None, None, cell(ws, 'GRAND TOTALS (POW 1-16):', 'label'), None]
     for col in range(6, 21):
-        col_letter = openpyxl.utils.get_column_letter(col)
-        formula = f"=SUM({col_letter}8:{col_letter}{row_num-1})"
-        cell = ws.cell(row=row_num, column=col, value=formula)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="E5E7EB", end_color="E5E7EB", fill_type="solid")
-        cell.border = border
-    
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 8
-    ws.column_dimensions['B'].width = 35
-    ws.column_dimensions['C'].width = 30
-    ws.column_dimensions['D'].width = 40
-    ws.column_dimensions['E'].width = 12
-    ws.column_dimensions['F'].width = 12
-    for col in range(7, 19):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 10
-    ws.column_dimensions['S'].width = 12
-    ws.column_dimensions['T'].width = 12
-    
-    # Save to BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+        col_letter = excel_export.get_column_letter(col)
+        totals.append(cell(ws, f"=SUM({col_letter}8:{col_letter}{row_num-1})", 'total'))
+    ws.append(totals)
     
     filename = f"Budget_Allocation_{financial_year.replace('/', '-')}.xlsx"
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return xlsx_response(wb, filename)
+
+def xlsx_response(wb, filename):
+    """Send a workbook as a download, streamed in chunks"""
+    from excel_export import save_workbook, iter_file, XLSX_MIMETYPE
+    output, size = save_workbook(wb)
+    response = Response(iter_file(output), mimetype=XLSX_MIMETYPE)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.content_length = size
+    return response
+
+def csv_response(rows, filename):
+    """Send rows as a CSV download, written out as they are read"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    response = Response(generate(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# Register exports: (rows reader, headers, XLSX column widths)
+REGISTER_EXPORTS = {
+    'debits': (iter_school_debits_export, DEBIT_EXPORT_HEADERS,
+               [12, 11, 11, 10, 35, 40, 30, 20, 14, 45, 14, 12]),
+    'credits': (iter_school_credits_export, CREDIT_EXPORT_HEADERS, [12, 11, 10, 35, 14, 40]),
+}
+
+def export_register(register):
+    """Stream a register as CSV or XLSX (?format=csv|xlsx, from, to, item)"""
+    school_id = get_current_school_id()
+    if not school_id:
+        return "Not authenticated", 401
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return "Unknown export format", 400
+
+    read_rows, headers, widths = REGISTER_EXPORTS[register]
+    financial_year = get_financial_year()
+    rows = read_rows(school_id, financial_year,
+                     request.args.get('from') or None,
+                     request.args.get('to') or None,
+                     request.args.get('item') or None)
+    filename = f"{register.capitalize()}_Register_{financial_year.replace('/', '-')}.{export_format}"
+
+    if export_format == 'csv':
+        return csv_response(itertools.chain([headers], rows), filename)
+
+    try:
+        import excel_export
+    except ImportError:
+        return "Excel export not available. Please install openpyxl: pip install openpyxl==3.1.2", 500
+    wb = excel_export.new_workbook()
+    ws = excel_export.new_sheet(wb, f"{register.capitalize()} Register", widths)
+    ws.freeze_panes = 'A2'
+    ws.append(excel_export.styled_row(ws, headers, 'header'))
+    for row in rows:
+        ws.append(row)
+    return xlsx_response(wb, filename)
+
+@app.route('/export_debits')
+@require_login
+@conditional_get('debits')
+@cached_export('debits')
+def export_debits():
+    """Export the debit register"""
+    return export_register('debits')
+
+@app.route('/export_credits')
+@require_login
+@conditional_get('credits')
+@cached_export('credits')
+def export_credits():
+    """Export the credit register"""
+    return export_register('credits')
 
 @app.route('/initialize_budget', methods=['GET', 'POST'])
 @require_login
@@ -957,36 +1082,49 @@ def update_budget():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/import_budget', methods=['POST'])
+@require_login
+def import_budget():
+    """Replace budget allocations with those of an uploaded budget export (XLSX or CSV)"""
+    try:
+        from budget_import import BudgetImportError, read_rows, parse_budget
+    except ImportError:
+        return jsonify({'success': False, 'errors': ['Budget import not available. Please install openpyxl: pip install openpyxl==3.1.2']}), 500
+
+    financial_year = get_financial_year()
+    if not get_budget(financial_year):
+        return jsonify({'success': False, 'errors': ['Budget not found for this financial year']}), 404
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'errors': ['Choose a file to import']}), 400
+
+    try:
+        items = parse_budget(read_rows(upload.stream, upload.filename), generate_budget_structure())
+    except BudgetImportError as e:
+        return jsonify({'success': False, 'errors': e.errors}), 400
+
+    # Every row is written in one transaction, so a failed import changes nothing
+    if not save_budget({'financialYear': financial_year, 'items': items}):
+        return jsonify({'success': False, 'errors': ['Failed to save budget']}), 500
+    return jsonify({'success': True, 'imported': len(items)})
+
 @app.route('/credits')
 @require_login
+@conditional_get('settings', 'budget', 'credits', 'debits')
 def credits():
     """Credit register page"""
     financial_year = get_financial_year()
     budget = get_budget(financial_year)
-    credits = get_credits(financial_year) or []
-    debits = get_debits(financial_year) or []
+    credits, pager = get_register_page(get_school_credits_page, financial_year)
     total_grant = get_total_grant(financial_year)
     settings = get_settings()
     
-    # Calculate total credits amount
-    total_credits_amount = 0.0
-    for c in credits:
-        if isinstance(c, dict):
-            line_items = c.get('lineItems', [])
-            for item in line_items:
-                if isinstance(item, dict):
-                    amt = item.get('amount', 0)
-                    if amt:
-                        try:
-                            total_credits_amount += float(amt)
-                        except (ValueError, TypeError):
-                            pass
-    
     return render_template('credits.html',
                       budget=budget,
                       credits=credits,
-                      debits=debits,
-                      total_credits_amount=total_credits_amount,
+                      pager=pager,
+                      credited_by_item=get_credited_by_item(financial_year),
+                      ledger=get_ledger(financial_year),
                       total_grant=total_grant,
                       financial_year=financial_year,
                       settings=settings,
@@ -1024,29 +1162,19 @@ def delete_credit(credit_id):
 
 @app.route('/debits')
 @require_login
+@conditional_get('settings', 'budget', 'credits', 'debits')
 def debits():
     """Debit register page"""
     financial_year = get_financial_year()
     budget = get_budget(financial_year)
-    credits = get_credits(financial_year)
-    debits = get_debits(financial_year)
-    available_funds = get_available_funds(financial_year)
+    debits, pager = get_register_page(get_school_debits_page, financial_year)
     settings = get_settings()
     
-    # Calculate grand totals for display
-    total_spent = sum(d.get('amount', 0) for d in debits)
-    total_credited = sum(
-        sum(li.get('amount', 0) for li in c.get('lineItems', []))
-        for c in credits
-    )
-    
     return render_template('debits.html',
                       budget=budget,
-                      credits=credits,
                       debits=debits,
-                      available_funds=available_funds,
-                      total_spent=total_spent,
-                      total_credited=total_credited,
+                      pager=pager,
+                      ledger=get_ledger(financial_year),
                       financial_year=financial_year,
                       settings=settings,
                       current_page='debits')
@@ -1062,12 +1190,28 @@ def add_debit():
     data = request.get_json()
     financial_year = data.get('financialYear', get_financial_year())
     
-    # Generate sequential document number for GP10
-    document_number = get_next_document_number(school_id, financial_year, 'gp10')
-    
+    # A debit must be charged to one of the school's budget items
+    if not data.get('itemId') or get_school_budget_item(school_id, financial_year, data['itemId']) is None:
+        return jsonify({'success': False, 'error': 'Select a budget item for this payment'}), 400
+    
+    # Overspending check against the materialized item balance
+    if not data.get('allowOverspend'):
+        try:
+            amount = float(data.get('amount') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid amount'}), 400
+        balance = get_school_item_balance(school_id, financial_year, data.get('itemId'))['balance']
+        if amount > balance:
+            return jsonify({
+                'success': False,
+                'overspend': True,
+                'balance': balance,
+                'error': f'Amount exceeds the available credited funds (K{balance:,.2f}) for this item'
+            })
+    
+    # The sequential GP10 number is allocated when the debit is saved
     debit_data = {
         'id': f"debit_{datetime.now().timestamp()}",
-        'documentNumber': document_number,
         'date': data.get('date'),
         'month': data.get('month'),
         'itemId': data.get('itemId'),
@@ -1099,65 +1243,109 @@ def delete_debit(debit_id):
 
 @app.route('/loose_minute/<debit_id>')
 @require_login
+@conditional_get('budget', 'debits')
 def loose_minute(debit_id):
-    """Generate Loose Minute View - assigns sequential number if not exists"""
+    """Generate Loose Minute View"""
     school_id = get_current_school_id()
     if not school_id:
         return "Not authenticated", 401
     
-    financial_year = get_financial_year()
-    budget = get_budget(financial_year)
-    debits = get_debits(financial_year)
-    debit = next((d for d in debits if d.get('id') == debit_id), None)
+    debit, budget = get_document_debit(get_financial_year(), debit_id)
     
     if not debit:
         return "Debit not found", 404
-    
-    # Generate and save sequential loose minute number if not exists
-    if not debit.get('looseMinuteNumber'):
-        loose_minute_number = get_next_document_number(school_id, financial_year, 'looseMinute')
-        update_school_debit(school_id, debit_id, {'looseMinuteNumber': loose_minute_number})
-        debit['looseMinuteNumber'] = loose_minute_number
         
-    return render_template('loose_minute.html', debit=debit, budget=budget)
+    return render_template('loose_minute.html', debits=[debit], budget=budget)
 
 @app.route('/gp10/<debit_id>')
 @require_login
+@conditional_get('settings', 'budget', 'debits')
 def gp10(debit_id):
     """Generate GP10 Voucher View"""
-    financial_year = get_financial_year()
-    budget = get_budget(financial_year)
-    debits = get_debits(financial_year)
-    debit = next((d for d in debits if d.get('id') == debit_id), None)
+    debit, budget = get_document_debit(get_financial_year(), debit_id)
     
     if not debit:
         return "Debit not found", 404
         
-    return render_template('gp10.html', debit=debit, budget=budget, settings=get_settings())
+    return render_template('gp10.html', debits=[debit], budget=budget, settings=get_settings())
 
 @app.route('/receipt/<debit_id>')
 @require_login
+@conditional_get('budget', 'debits')
 def payment_receipt(debit_id):
-    """Generate Payment Receipt View - assigns sequential number if not exists"""
+    """Generate Payment Receipt View"""
     school_id = get_current_school_id()
     if not school_id:
         return "Not authenticated", 401
     
-    financial_year = get_financial_year()
-    budget = get_budget(financial_year)
-    debits = get_debits(financial_year)
-    debit = next((d for d in debits if d.get('id') == debit_id), None)
+    debit, budget = get_document_debit(get_financial_year(), debit_id)
     
     if not debit:
         return "Debit not found", 404
-    
-    # Generate and save sequential receipt number if not exists
-    if not debit.get('receiptNumber'):
-        receipt_number = get_next_document_number(school_id, financial_year, 'receipt')
-        update_school_debit(school_id, debit_id, {'receiptNumber': receipt_number})
-        debit['receiptNumber'] = receipt_number
         
-    return render_template('receipt.html', debit=debit, budget=budget)
+    return render_template('receipt.html', debits=[debit], budget=budget)
+
+# Printable documents -> template
+PRINT_DOCUMENTS = {
+    'gp10': 'gp10.html',
+    'loose_minute': 'loose_minute.html',
+    'receipt': 'receipt.html',
+}
+
+def get_selected_debits(args):
+    """Debits picked by month, from/to (date paid, inclusive) and/or ids (comma separated)"""
+    ids = args.get('ids')
+    return get_school_debits_for_documents(
+        get_current_school_id(), get_financial_year(),
+        args.get('month') or None,
+        args.get('from') or None,
+        args.get('to') or None,
+        [debit_id.strip() for debit_id in ids.split(',') if debit_id.strip()] if ids else None
+    )
+
+@app.route('/print_documents')
+@require_login
+@conditional_get('settings', 'budget', 'debits')
+def print_documents():
+    """Print one document type (gp10, loose_minute or receipt) for many debits as a single bundle"""
+    school_id = get_current_school_id()
+    if not school_id:
+        return "Not authenticated", 401
+
+    template = PRINT_DOCUMENTS.get(request.args.get('type', 'gp10'))
+    if template is None:
+        return "Unknown document type", 400
+
+    debits = get_selected_debits(request.args)
+    if not debits:
+        return "No debits to print", 404
+
+    financial_year = get_financial_year()
+    budget = get_school_budget(school_id, financial_year)
+    items = {item['id']: item for item in budget['items']} if budget else {}
+    for debit in debits:
+        add_item_details(debit, items.get(debit.get('itemId')))
+
+    return render_template(template, debits=debits, budget=get_document_header(financial_year),
+                           settings=get_settings())
+
+@app.route('/finalize_documents', methods=['POST'])
+@require_login
+def finalize_documents():
+    """Give the selected debits their loose minute and receipt numbers.
+
+    Takes the same month/from/to/ids selection as /print_documents; debits
+    that already have numbers keep them.
+    """
+    school_id = get_current_school_id()
+    if not school_id:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    debits = get_selected_debits(request.get_json(silent=True) or request.form)
+    assigned = assign_debit_document_numbers(
+        school_id, get_financial_year(), [debit['id'] for debit in debits])
+    return jsonify({'success': True,
+                    'numbered': {doc_type: len(numbers) for doc_type, numbers in assigned.items()}})
 
 @app.route('/settings', methods=['GET', 'POST'])
 @require_login
@@ -1218,38 +1406,23 @@ def settings():
 
 @app.route('/tracking')
 @require_login
+@conditional_get('settings', 'budget', 'credits', 'debits')
 def tracking():
     """Spending tracking page"""
     financial_year = get_financial_year()
     budget = get_budget(financial_year)
-    credits = get_credits(financial_year) or []
-    debits = get_debits(financial_year) or []
-    spending = calculate_spending(budget, debits)
     total_grant = get_total_grant(financial_year)
     
-    # Calculate total spent
-    total_spent = 0.0
-    for d in debits:
-        if isinstance(d, dict):
-            amt = d.get('amount', 0)
-            if amt:
-                try:
-                    total_spent += float(amt)
-                except (ValueError, TypeError):
-                    pass
-    
     return render_template('tracking.html',
                       budget=budget,
-                      credits=credits,
-                      debits=debits,
-                      spending=spending,
-                      total_spent=total_spent,
+                      ledger=get_ledger(financial_year),
                       total_grant=total_grant,
                       financial_year=financial_year,
                       settings=get_settings(),
                       current_page='tracking')
 
 if __name__ == '__main__':
+    setup_database()
     print("🚀 Starting Grant Management System - Multi-Tenant")
     print("📱 Access at: http://localhost:5176")
     print("\n🔐 Default Login Credentials:")
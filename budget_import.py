@@ -0,0 +1,159 @@
+"""
+Bulk budget import from the budget export layout
+
+Schools prepare their budgets in Excel and used to re-key every cell into
+the budget page. An import takes a file in the layout export_budget_excel
+produces (a 'POW No' header row, then one row per budget item with the
+annual allocation and April..March) as XLSX or CSV, validates every row in
+one pass and returns either the items to save or the complete list of
+problems, so a school fixes its file once instead of error by error.
+
+Rows are matched to the budget template by POW No and Code; where a POW
+uses the same code on several rows (POW 10) the Sub Activity decides.
+Workbooks are read in openpyxl's read-only mode, which streams rows from
+the file instead of loading the whole sheet.
+"""
+import csv
+import io
+import re
+
+from database import MONTHS
+
+# Largest difference between an item's months and its annual allocation
+# that still counts as equal (rounding in spreadsheet formulas)
+IMPORT_TOLERANCE = 0.01
+# A file with more data rows than this is rejected
+IMPORT_MAX_ROWS = 500
+
+HEADER = 'POW No'
+COLUMNS = ['POW No', 'POW Name', 'Sub Activity', 'Sub Item Description', 'Code', 'Annual Allocation'] + list(MONTHS)
+
+
+class BudgetImportError(Exception):
+    """The file cannot be imported; errors lists every problem found"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def read_rows(stream, filename):
+    """Rows (tuples of cell values) of an uploaded .xlsx or .csv file"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            return [tuple(row) for row in csv.reader(text)]
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise BudgetImportError([f'Could not read the CSV file: {e}'])
+    if extension == 'xlsx':
+        from openpyxl import load_workbook
+        try:
+            wb = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            raise BudgetImportError([f'Could not read the workbook: {e}'])
+        try:
+            ws = wb['Budget Allocation'] if 'Budget Allocation' in wb.sheetnames else wb.worksheets[0]
+            return list(ws.iter_rows(values_only=True))
+        finally:
+            wb.close()
+    raise BudgetImportError(['Upload an .xlsx or .csv file'])
+
+
+def _text(value):
+    """A cell as text; whole numbers lose the '.0' Excel gives codes typed as numbers"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _amount(value):
+    """A cell as an amount (blank is 0), or None if it is not a number"""
+    if value is None or isinstance(value, (int, float)):
+        return float(value or 0)
+    text = re.sub(r'[,\s]|^(MWK|K)', '', str(value).strip(), flags=re.IGNORECASE)
+    if not text:
+        return 0.0
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_budget(rows, template):
+    """Validate imported rows against the budget template
+
+    Returns the budget items ready for save_school_budget, in template
+    order; raises BudgetImportError listing every problem (with spreadsheet
+    row numbers) if any row is invalid.
+    """
+    candidates = {}
+    for item in template:
+        candidates.setdefault((item['powNo'], item['code']), []).append(item)
+
+    rows = iter(enumerate(rows, 1))
+    header = None
+    for row_number, row in rows:
+        if row and _text(row[0]) == HEADER:
+            header = [_text(value) for value in row]
+            break
+    if header is None:
+        raise BudgetImportError([f"No '{HEADER}' header row found; use the layout of the budget export"])
+    missing = [name for name in COLUMNS if name not in header]
+    if missing:
+        raise BudgetImportError([f"Row {row_number}: missing column(s) {', '.join(missing)}"])
+    column = {name: header.index(name) for name in COLUMNS}
+
+    errors = []
+    items = {}
+    data_rows = 0
+    for row_number, row in rows:
+        values = {name: row[index] if index < len(row) else None for name, index in column.items()}
+        pow_no, code = _text(values['POW No']), _text(values['Code'])
+        if not pow_no and not code:
+            # Blank rows and the grand totals row
+            continue
+        data_rows += 1
+        if data_rows > IMPORT_MAX_ROWS:
+            errors.append(f'Row {row_number}: more than {IMPORT_MAX_ROWS} rows')
+            break
+
+        matches = candidates.get((pow_no, code), [])
+        if len(matches) > 1:
+            sub_activity = _text(values['Sub Activity']).lower()
+            matches = [item for item in matches if item['subActivity'].lower() == sub_activity]
+        if len(matches) != 1:
+            errors.append(f'Row {row_number}: POW {pow_no} code {code} is not in the budget template')
+            continue
+        template_item = matches[0]
+        if template_item['template_row_id'] in items:
+            errors.append(f'Row {row_number}: POW {pow_no} code {code} '
+                          f"({template_item['subItemDescription']}) appears more than once")
+            continue
+
+        amounts = {name: _amount(values[name]) for name in ['Annual Allocation'] + list(MONTHS)}
+        bad = [name for name, amount in amounts.items() if amount is None or amount < 0]
+        if bad:
+            errors.append(f"Row {row_number}: {', '.join(bad)} must be a number of 0 or more")
+            continue
+        annual = amounts.pop('Annual Allocation')
+        monthly_total = sum(amounts.values())
+        if abs(monthly_total - annual) > IMPORT_TOLERANCE:
+            errors.append(f'Row {row_number}: months add up to {monthly_total:,.2f} '
+                          f'but the annual allocation is {annual:,.2f}')
+            continue
+
+        items[template_item['template_row_id']] = {
+            **{key: template_item[key] for key in
+               ('template_row_id', 'id', 'powNo', 'powName', 'subActivity', 'subItemDescription', 'code')},
+            'totalAllocation': annual,
+            'monthlyAllocations': amounts
+        }
+
+    if not items and not errors:
+        errors.append('The file has no budget rows')
+    if errors:
+        raise BudgetImportError(errors)
+    return [items[key] for key in sorted(items)]
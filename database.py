@@ -1,14 +1,52 @@
 """
 Multi-Tenant Database Schema and Management
 """
+import os
+import queue
 import sqlite3
 import hashlib
+import json
 import secrets
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
 DATABASE_PATH = 'data/grant_management.db'
 
+# Financial year months (April - March) and their budget_items columns
+MONTHS = ["April", "May", "June", "July", "August", "September",
+          "October", "November", "December", "January", "February", "March"]
+MONTH_COLUMNS = [f"alloc_{month.lower()}" for month in MONTHS]
+
+# Document types -> (document_sequences counter column, debits number column)
+DOCUMENT_SEQUENCES = {
+    'gp10': ('gp10_last_no', 'document_number'),
+    'looseMinute': ('loose_minute_last_no', 'loose_minute_number'),
+    'receipt': ('receipt_last_no', 'receipt_number'),
+}
+
+# When loose minute and receipt numbers are allocated: 'save' gives every
+# debit its numbers as it is recorded, 'finalize' leaves them to an explicit
+# finalize step. Viewing a document never allocates a number.
+DOCUMENT_NUMBERING = os.environ.get('DOCUMENT_NUMBERING', 'save')
+
+# Kinds of tenant data whose versions are tracked in tenant_versions
+TENANT_DATA_KINDS = ('settings', 'budget', 'credits', 'debits')
+
+# Connection pool sizing (per worker process). Readers are read-only
+# connections; writers are few because SQLite serializes writes anyway.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_WRITER_POOL_SIZE = int(os.environ.get('DB_WRITER_POOL_SIZE', '2'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+# Optional single-writer queue: funnel writes through one thread per process
+# and commit them in groups (DB_WRITE_QUEUE=1 to enable)
+DB_WRITE_QUEUE = os.environ.get('DB_WRITE_QUEUE', '0') == '1'
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', '64'))
+DB_WRITE_TIMEOUT = float(os.environ.get('DB_WRITE_TIMEOUT', '30'))
+
 def hash_password(password):
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -17,15 +55,192 @@ def verify_password(password, password_hash):
     """Verify password against hash"""
     return hash_password(password) == password_hash
 
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the timeout"""
+
+class ConnectionPool:
+    """Thread-safe pool of warm SQLite connections for one worker process.
+
+    PRAGMAs are applied once when a connection is opened; afterwards the
+    connection is reused across requests instead of being closed.
+
+    A read-only pool opens connections with ``mode=ro`` and ``query_only``
+    so they can never take a write lock. A writer pool begins every write
+    with ``BEGIN IMMEDIATE`` so the lock is taken up front instead of failing
+    on a read-to-write upgrade.
+    """
+
+    def __init__(self, database_path, readonly=False, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.database_path = database_path
+        self.readonly = readonly
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._connects = 0
+        self._checkout_time = 0.0
+        self._max_checkout_time = 0.0
+
+    def _connect(self):
+        """Open a new connection and apply the per-connection PRAGMAs"""
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{self.database_path}?mode=ro', uri=True,
+                                   timeout=10.0, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA query_only=ON')
+        else:
+            conn = sqlite3.connect(self.database_path, timeout=10.0, check_same_thread=False,
+                                   isolation_level='IMMEDIATE')
+            # Enable WAL mode for better concurrency
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout=10000')
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening one if the pool is not yet full"""
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        waited = False
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Connection pool is closed')
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                waited = True
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                self._cond.wait(remaining)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._connects += 1
+
+        elapsed = time.perf_counter() - start
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._checkout_time += elapsed
+            self._max_checkout_time = max(self._max_checkout_time, elapsed)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding it if it is unusable"""
+        reusable = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            reusable = False
+
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            return {
+                'database': self.database_path,
+                'readonly': self.readonly,
+                'pid': self.pid,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'connects': self._connects,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'avg_checkout_ms': round(self._checkout_time / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'max_checkout_ms': round(self._max_checkout_time * 1000, 3)
+            }
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    """Get the reader or writer connection pool for this process.
+
+    Pools are created on first use, and again after a fork (gunicorn
+    workers) or when DATABASE_PATH changes; inherited connections are never
+    reused.
+    """
+    pool = _pools.get(readonly)
+    if pool is not None and pool.pid == os.getpid() and pool.database_path == DATABASE_PATH:
+        return pool
+    with _pool_lock:
+        pool = _pools.get(readonly)
+        if pool is None or pool.pid != os.getpid() or pool.database_path != DATABASE_PATH:
+            if pool is not None and pool.pid == os.getpid():
+                pool.close()
+            max_size = DB_POOL_SIZE if readonly else DB_WRITER_POOL_SIZE
+            pool = _pools[readonly] = ConnectionPool(DATABASE_PATH, readonly=readonly, max_size=max_size)
+        return pool
+
+def close_pool():
+    """Stop this process's writer thread and close its reader and writer pools"""
+    close_write_queue()
+    with _pool_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+def get_pool_stats():
+    """Pool size, checkout latency and wait counts for this process"""
+    stats = {
+        'reader': get_pool(readonly=True).stats(),
+        'writer': get_pool().stats()
+    }
+    if DB_WRITE_QUEUE:
+        stats['write_queue'] = get_write_queue().stats()
+    return stats
+
 @contextmanager
 def get_db():
-    """Database connection context manager with WAL mode and busy timeout"""
-    conn = sqlite3.connect(DATABASE_PATH, timeout=10.0)
-    conn.row_factory = sqlite3.Row
-    # Enable WAL mode for better concurrency
-    conn.execute('PRAGMA journal_mode=WAL')
-    conn.execute('PRAGMA synchronous=NORMAL')
-    conn.execute('PRAGMA busy_timeout=10000')
+    """Writer connection context manager - commits on success"""
+    pool = get_pool()
+    conn = pool.acquire()
     try:
         yield conn
         conn.commit()
@@ -33,7 +248,158 @@ def get_db():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        pool.release(conn)
+
+@contextmanager
+def get_read_db():
+    """Read-only connection context manager - never locks or commits"""
+    pool = get_pool(readonly=True)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+class WriteQueue:
+    """Single writer thread that applies queued writes with group commit.
+
+    Each job is a function taking a connection. Jobs waiting in the queue
+    are applied together in one IMMEDIATE transaction, each inside its own
+    savepoint so a failing job only rolls back itself. A job's future
+    resolves with its return value only after the group has committed.
+    close() applies the jobs already queued and stops the thread.
+    """
+
+    def __init__(self, batch_size=DB_WRITE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._jobs = 0
+        self._failed = 0
+        self._max_batch = 0
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func):
+        """Queue a write; returns a Future for its result"""
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def close(self, timeout=None):
+        """Stop the writer thread once the jobs queued so far are applied"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            job = self._queue.get()
+            while job is not None:
+                batch.append(job)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = job is None
+            if batch:
+                self._apply(batch)
+
+    def _apply(self, batch):
+        # (result, exception) per job; futures resolve once the counters
+        # include the batch, so a caller never sees stats behind its write
+        outcomes = []
+        pool = get_pool()
+        try:
+            conn = pool.acquire()
+        except Exception as e:
+            outcomes = [(None, e)] * len(batch)
+        else:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for func, _ in batch:
+                    conn.execute('SAVEPOINT write_job')
+                    try:
+                        result = func(conn)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write_job')
+                        conn.execute('RELEASE write_job')
+                        outcomes.append((None, e))
+                        continue
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((result, None))
+                conn.commit()
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    pass
+                outcomes = [(None, error or e) for _, error in outcomes]
+                outcomes += [(None, e)] * (len(batch) - len(outcomes))
+            finally:
+                pool.release(conn)
+
+        with self._lock:
+            self._batches += 1
+            self._jobs += len(batch)
+            self._failed += sum(1 for _, error in outcomes if error is not None)
+            self._max_batch = max(self._max_batch, len(batch))
+        for (_, future), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        """Snapshot of writer counters"""
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'batches': self._batches,
+                'jobs': self._jobs,
+                'failed': self._failed,
+                'avg_batch_size': round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                'max_batch_size': self._max_batch
+            }
+
+_write_queue = None
+
+def get_write_queue():
+    """Get this process's writer thread, starting it on first use"""
+    global _write_queue
+    if _write_queue is None or _write_queue.pid != os.getpid():
+        with _pool_lock:
+            if _write_queue is None or _write_queue.pid != os.getpid():
+                _write_queue = WriteQueue()
+    return _write_queue
+
+def close_write_queue():
+    """Stop this process's writer thread (the next queued write starts a new one)"""
+    global _write_queue
+    with _pool_lock:
+        writer, _write_queue = _write_queue, None
+    if writer is not None and writer.pid == os.getpid():
+        writer.close()
+
+def run_write(func):
+    """Run a write function on the writer path and return its result.
+
+    With DB_WRITE_QUEUE enabled the function is applied by the writer
+    thread (group commit); otherwise it runs in its own transaction here.
+    """
+    if DB_WRITE_QUEUE:
+        return get_write_queue().submit(func).result(timeout=DB_WRITE_TIMEOUT)
+    with get_db() as conn:
+        # sqlite3 only begins a transaction at the first INSERT/UPDATE/DELETE,
+        # so take the write lock now: a SELECT the write depends on must not
+        # run before it
+        conn.execute('BEGIN IMMEDIATE')
+        return func(conn)
 
 def init_database():
     """Initialize multi-tenant database schema"""
@@ -100,6 +466,18 @@ def init_database():
                 code TEXT,
                 total_allocation REAL DEFAULT 0,
                 monthly_allocations TEXT,
+                alloc_april REAL DEFAULT 0,
+                alloc_may REAL DEFAULT 0,
+                alloc_june REAL DEFAULT 0,
+                alloc_july REAL DEFAULT 0,
+                alloc_august REAL DEFAULT 0,
+                alloc_september REAL DEFAULT 0,
+                alloc_october REAL DEFAULT 0,
+                alloc_november REAL DEFAULT 0,
+                alloc_december REAL DEFAULT 0,
+                alloc_january REAL DEFAULT 0,
+                alloc_february REAL DEFAULT 0,
+                alloc_march REAL DEFAULT 0,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (school_id) REFERENCES schools(id),
                 UNIQUE(school_id, financial_year, template_row_id)
@@ -217,8 +595,467 @@ def init_database():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_credits_school ON credits(school_id, financial_year)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_debits_school ON debits(school_id, financial_year)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_school ON school_sessions(school_id)')
-        
-        print("✅ Multi-tenant database initialized successfully")
+    
+    upgrade_schema()
+    print("✅ Multi-tenant database initialized successfully")
+
+def _migrate_monthly_allocations(cursor):
+    """Move budget_items.monthly_allocations JSON into per-month REAL columns"""
+    cursor.execute("PRAGMA table_info(budget_items)")
+    columns = [row[1] for row in cursor.fetchall()]
+    for column in MONTH_COLUMNS:
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE budget_items ADD COLUMN {column} REAL DEFAULT 0')
+    
+    cursor.execute('''
+        SELECT id, monthly_allocations FROM budget_items
+        WHERE monthly_allocations IS NOT NULL
+    ''')
+    rows = cursor.fetchall()
+    for row in rows:
+        try:
+            monthly = json.loads(row['monthly_allocations'] or '{}')
+        except ValueError:
+            monthly = {}
+        values = []
+        for month in MONTHS:
+            try:
+                values.append(float(monthly.get(month) or 0))
+            except (TypeError, ValueError):
+                values.append(0.0)
+        assignments = ', '.join(f'{column} = ?' for column in MONTH_COLUMNS)
+        cursor.execute(f'''
+            UPDATE budget_items SET {assignments}, monthly_allocations = NULL
+            WHERE id = ?
+        ''', values + [row['id']])
+    if rows:
+        print(f"✅ Migrated monthly allocations for {len(rows)} budget rows")
+
+def _migrate_credit_line_items(cursor):
+    """Move credits.line_items JSON into the indexed credit_line_items table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS credit_line_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            credit_id INTEGER NOT NULL,
+            school_id INTEGER NOT NULL,
+            financial_year TEXT NOT NULL,
+            line_no INTEGER NOT NULL,
+            item_id TEXT,
+            sub_item_description TEXT,
+            code TEXT,
+            amount REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (credit_id) REFERENCES credits(id),
+            FOREIGN KEY (school_id) REFERENCES schools(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_credit_lines_item ON credit_line_items(school_id, financial_year, item_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_credit_lines_credit ON credit_line_items(credit_id)')
+    # Line items go with their credit, whichever code path deletes it
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_credits_delete_lines
+        AFTER DELETE ON credits
+        BEGIN
+            DELETE FROM credit_line_items WHERE credit_id = OLD.id;
+        END
+    ''')
+    
+    cursor.execute('''
+        SELECT id, school_id, financial_year, line_items FROM credits
+        WHERE line_items IS NOT NULL AND line_items NOT IN ('', '[]')
+    ''')
+    rows = cursor.fetchall()
+    for row in rows:
+        try:
+            line_items = json.loads(row['line_items'])
+        except ValueError:
+            line_items = []
+        insert_credit_line_items(cursor, row['id'], row['school_id'], row['financial_year'], line_items)
+        cursor.execute("UPDATE credits SET line_items = '[]' WHERE id = ?", (row['id'],))
+    if rows:
+        print(f"✅ Migrated line items for {len(rows)} credits")
+
+def insert_credit_line_items(cursor, credit_id, school_id, financial_year, line_items):
+    """Insert the line items of one credit"""
+    rows = []
+    for line_no, li in enumerate(line_items, 1):
+        if not isinstance(li, dict):
+            continue
+        try:
+            amount = float(li.get('amount') or 0)
+        except (TypeError, ValueError):
+            amount = 0.0
+        rows.append((credit_id, school_id, financial_year, line_no, li.get('itemId'),
+                     li.get('subItemDescription'), li.get('code'), amount))
+    cursor.executemany('''
+        INSERT INTO credit_line_items
+        (credit_id, school_id, financial_year, line_no, item_id, sub_item_description, code, amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+def _create_item_balances(cursor):
+    """Materialized credited/spent per budget item, kept current by triggers"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'budget_item_balances'")
+    exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_item_balances (
+            school_id INTEGER NOT NULL,
+            financial_year TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            credited REAL NOT NULL DEFAULT 0,
+            spent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (school_id, financial_year, item_key)
+        )
+    ''')
+    
+    # (source table, column to adjust) - each row adds its amount on insert
+    # and takes it back on delete; updates do both
+    for table, column in (('credit_line_items', 'credited'), ('debits', 'spent')):
+        add = f'''
+            INSERT INTO budget_item_balances (school_id, financial_year, item_key, {column})
+            SELECT NEW.school_id, NEW.financial_year, NEW.item_id, NEW.amount
+            WHERE NEW.item_id IS NOT NULL
+            ON CONFLICT (school_id, financial_year, item_key)
+            DO UPDATE SET {column} = {column} + excluded.{column};
+        '''
+        remove = f'''
+            UPDATE budget_item_balances SET {column} = {column} - OLD.amount
+            WHERE school_id = OLD.school_id AND financial_year = OLD.financial_year
+            AND item_key = OLD.item_id;
+        '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_insert
+            AFTER INSERT ON {table} WHEN NEW.item_id IS NOT NULL
+            BEGIN {add} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_delete
+            AFTER DELETE ON {table} WHEN OLD.item_id IS NOT NULL
+            BEGIN {remove} END
+        ''')
+        # Rows without an item are skipped, as on insert and delete (the
+        # trigger is recreated so databases made before the guard get it)
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_balance_update')
+        cursor.execute(f'''
+            CREATE TRIGGER trg_{table}_balance_update
+            AFTER UPDATE OF school_id, financial_year, item_id, amount ON {table}
+            WHEN OLD.item_id IS NOT NULL OR NEW.item_id IS NOT NULL
+            BEGIN {remove} {add} END
+        ''')
+    
+    if not exists:
+        rebuild_item_balances(cursor)
+
+def _item_balance_totals_sql():
+    """Credited/spent per (school, year, item) computed from the registers"""
+    return '''
+        SELECT school_id, financial_year, item_key,
+               SUM(credited) AS credited, SUM(spent) AS spent
+        FROM (
+            SELECT school_id, financial_year, item_id AS item_key, amount AS credited, 0 AS spent
+            FROM credit_line_items WHERE item_id IS NOT NULL
+            UNION ALL
+            SELECT school_id, financial_year, item_id, 0, amount
+            FROM debits WHERE item_id IS NOT NULL
+        )
+        GROUP BY school_id, financial_year, item_key
+    '''
+
+def rebuild_item_balances(cursor):
+    """Recompute budget_item_balances from the credit and debit registers"""
+    cursor.execute('DELETE FROM budget_item_balances')
+    cursor.execute(f'''
+        INSERT INTO budget_item_balances (school_id, financial_year, item_key, credited, spent)
+        {_item_balance_totals_sql()}
+    ''')
+    return cursor.rowcount
+
+def _verify_totals(cursor, table, key_column, totals_sql, tolerance):
+    """Rows of a credited/spent summary table that differ from totals_sql"""
+    cursor.execute(f'''
+        SELECT school_id, financial_year, {key_column},
+               SUM(stored_credited) AS stored_credited, SUM(actual_credited) AS actual_credited,
+               SUM(stored_spent) AS stored_spent, SUM(actual_spent) AS actual_spent
+        FROM (
+            SELECT school_id, financial_year, {key_column},
+                   credited AS stored_credited, 0 AS actual_credited,
+                   spent AS stored_spent, 0 AS actual_spent
+            FROM {table}
+            UNION ALL
+            SELECT school_id, financial_year, {key_column}, 0, credited, 0, spent
+            FROM ({totals_sql})
+        )
+        GROUP BY school_id, financial_year, {key_column}
+        HAVING ABS(SUM(stored_credited) - SUM(actual_credited)) > ?
+            OR ABS(SUM(stored_spent) - SUM(actual_spent)) > ?
+    ''', (tolerance, tolerance))
+    return [dict(row) for row in cursor.fetchall()]
+
+def verify_item_balances(cursor, tolerance=0.005):
+    """List balance rows that differ from the registers (empty when consistent)"""
+    return _verify_totals(cursor, 'budget_item_balances', 'item_key',
+                          _item_balance_totals_sql(), tolerance)
+
+def _create_monthly_summary(cursor):
+    """Credited/spent per school, year and month, kept current by triggers"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'monthly_summary'")
+    exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_summary (
+            school_id INTEGER NOT NULL,
+            financial_year TEXT NOT NULL,
+            month TEXT NOT NULL,
+            credited REAL NOT NULL DEFAULT 0,
+            spent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (school_id, financial_year, month)
+        )
+    ''')
+    
+    def add(column, school_id, financial_year, month, amount):
+        return f'''
+            INSERT INTO monthly_summary (school_id, financial_year, month, {column})
+            SELECT {school_id}, {financial_year}, {month}, {amount} WHERE {month} IS NOT NULL
+            ON CONFLICT (school_id, financial_year, month)
+            DO UPDATE SET {column} = {column} + excluded.{column};
+        '''
+    
+    def remove(column, school_id, financial_year, month, amount):
+        return f'''
+            UPDATE monthly_summary SET {column} = {column} - {amount}
+            WHERE school_id = {school_id} AND financial_year = {financial_year}
+            AND month = {month};
+        '''
+    
+    # Debits carry their own month
+    new_debit = ('spent', 'NEW.school_id', 'NEW.financial_year', 'NEW.month', 'NEW.amount')
+    old_debit = ('spent', 'OLD.school_id', 'OLD.financial_year', 'OLD.month', 'OLD.amount')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_debits_monthly_insert
+        AFTER INSERT ON debits
+        BEGIN {add(*new_debit)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_debits_monthly_delete
+        AFTER DELETE ON debits
+        BEGIN {remove(*old_debit)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_debits_monthly_update
+        AFTER UPDATE OF school_id, financial_year, month, amount ON debits
+        BEGIN {remove(*old_debit)} {add(*new_debit)} END
+    ''')
+    
+    # Credit lines take the month of their credit. Deleting a credit takes
+    # back its whole total before its lines are removed, so the line trigger
+    # only handles lines deleted while the credit still exists.
+    new_line = ('credited', 'NEW.school_id', 'NEW.financial_year',
+                '(SELECT month FROM credits WHERE id = NEW.credit_id)', 'NEW.amount')
+    old_line = ('credited', 'OLD.school_id', 'OLD.financial_year',
+                '(SELECT month FROM credits WHERE id = OLD.credit_id)', 'OLD.amount')
+    credit_total = '(SELECT COALESCE(SUM(amount), 0) FROM credit_line_items WHERE credit_id = {0}.id)'
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_credit_line_items_monthly_insert
+        AFTER INSERT ON credit_line_items
+        BEGIN {add(*new_line)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_credit_line_items_monthly_delete
+        AFTER DELETE ON credit_line_items
+        WHEN EXISTS (SELECT 1 FROM credits WHERE id = OLD.credit_id)
+        BEGIN {remove(*old_line)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_credits_monthly_delete
+        BEFORE DELETE ON credits
+        BEGIN {remove('credited', 'OLD.school_id', 'OLD.financial_year', 'OLD.month',
+                      credit_total.format('OLD'))} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_credits_monthly_update
+        AFTER UPDATE OF school_id, financial_year, month ON credits
+        BEGIN
+            {remove('credited', 'OLD.school_id', 'OLD.financial_year', 'OLD.month',
+                    credit_total.format('NEW'))}
+            {add('credited', 'NEW.school_id', 'NEW.financial_year', 'NEW.month',
+                 credit_total.format('NEW'))}
+        END
+    ''')
+    
+    if not exists:
+        rebuild_monthly_summary(cursor)
+
+def _monthly_totals_sql():
+    """Credited/spent per (school, year, month) computed from the registers"""
+    return '''
+        SELECT school_id, financial_year, month,
+               SUM(credited) AS credited, SUM(spent) AS spent
+        FROM (
+            SELECT l.school_id, l.financial_year, c.month, l.amount AS credited, 0 AS spent
+            FROM credit_line_items l JOIN credits c ON c.id = l.credit_id
+            WHERE c.month IS NOT NULL
+            UNION ALL
+            SELECT school_id, financial_year, month, 0, amount
+            FROM debits WHERE month IS NOT NULL
+        )
+        GROUP BY school_id, financial_year, month
+    '''
+
+def rebuild_monthly_summary(cursor):
+    """Recompute monthly_summary from the credit and debit registers"""
+    cursor.execute('DELETE FROM monthly_summary')
+    cursor.execute(f'''
+        INSERT INTO monthly_summary (school_id, financial_year, month, credited, spent)
+        {_monthly_totals_sql()}
+    ''')
+    return cursor.rowcount
+
+def verify_monthly_summary(cursor, tolerance=0.005):
+    """List monthly rows that differ from the registers (empty when consistent)"""
+    return _verify_totals(cursor, 'monthly_summary', 'month',
+                          _monthly_totals_sql(), tolerance)
+
+def _max_issued_sql(number_column):
+    """Highest numeric document number already issued for a school and year"""
+    return f'''
+        SELECT COALESCE(MAX(CAST({number_column} AS INTEGER)), 0)
+        FROM debits
+        WHERE school_id = ? AND financial_year = ?
+        AND {number_column} GLOB '[0-9]*'
+    '''
+
+def _sync_document_sequences(cursor):
+    """Raise stored counters to the highest numbers already on debits"""
+    for counter_column, number_column in DOCUMENT_SEQUENCES.values():
+        cursor.execute(f'''
+            UPDATE document_sequences
+            SET {counter_column} = MAX(COALESCE({counter_column}, 0), (
+                SELECT COALESCE(MAX(CAST(d.{number_column} AS INTEGER)), 0)
+                FROM debits d
+                WHERE d.school_id = document_sequences.school_id
+                AND d.financial_year = document_sequences.financial_year
+                AND d.{number_column} GLOB '[0-9]*'
+            ))
+        ''')
+
+def _backfill_document_numbers(cursor):
+    """Number the loose minutes and receipts of debits saved before numbers
+    were allocated at write time (only when DOCUMENT_NUMBERING is 'save';
+    with 'finalize' schools number them with the Finalize button)"""
+    if DOCUMENT_NUMBERING != 'save':
+        return
+    for doc_type in ('looseMinute', 'receipt'):
+        _, number_column = DOCUMENT_SEQUENCES[doc_type]
+        cursor.execute(f'''
+            SELECT school_id, financial_year, id FROM debits
+            WHERE {number_column} IS NULL OR {number_column} = ''
+            ORDER BY school_id, financial_year, date_paid, id
+        ''')
+        unnumbered = {}
+        for row in cursor.fetchall():
+            unnumbered.setdefault((row['school_id'], row['financial_year']), []).append(row['id'])
+        for (school_id, financial_year), debit_ids in unnumbered.items():
+            numbers = allocate_document_numbers(cursor, school_id, financial_year, doc_type, len(debit_ids))
+            cursor.executemany(f'''
+                UPDATE debits SET {number_column} = ? WHERE id = ?
+            ''', list(zip(numbers, debit_ids)))
+            bump_tenant_versions(cursor, school_id, ['debits'])
+
+def allocate_document_numbers(cursor, school_id, financial_year, doc_type, count=1):
+    """Atomically take the next ``count`` numbers of a document type.
+
+    Must run inside a write transaction. The sequence row is seeded from the
+    debits already issued the first time a school/year allocates.
+    """
+    counter_column, _ = DOCUMENT_SEQUENCES[doc_type]
+    if count < 1:
+        raise ValueError('count must be at least 1')
+    cursor.execute('''
+        SELECT 1 FROM document_sequences WHERE school_id = ? AND financial_year = ?
+    ''', (school_id, financial_year))
+    if cursor.fetchone() is None:
+        params = (school_id, financial_year) * len(DOCUMENT_SEQUENCES)
+        seeds = ', '.join(f'({_max_issued_sql(number_column)})'
+                          for _, number_column in DOCUMENT_SEQUENCES.values())
+        # Callers holding a plain get_db() connection run the check above
+        # before their write transaction starts, so another writer may have
+        # seeded the row in between
+        cursor.execute(f'''
+            INSERT INTO document_sequences
+            (school_id, financial_year, gp10_last_no, loose_minute_last_no, receipt_last_no)
+            VALUES (?, ?, {seeds})
+            ON CONFLICT (school_id, financial_year) DO NOTHING
+        ''', (school_id, financial_year) + params)
+    cursor.execute(f'''
+        UPDATE document_sequences
+        SET {counter_column} = COALESCE({counter_column}, 0) + ?, updated_at = CURRENT_TIMESTAMP
+        WHERE school_id = ? AND financial_year = ?
+        RETURNING {counter_column}
+    ''', (count, school_id, financial_year))
+    last_no = cursor.fetchall()[0][0]
+    return [f"{number:04d}" for number in range(last_no - count + 1, last_no + 1)]
+
+# Current time as fractional Unix seconds
+UNIX_NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+
+def _create_tenant_versions(cursor):
+    """Per-school version counters (and change times) of each kind of tenant data"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tenant_versions (
+            school_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL,
+            PRIMARY KEY (school_id, kind)
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(tenant_versions)")
+    if 'updated_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE tenant_versions ADD COLUMN updated_at REAL')
+
+def bump_tenant_versions(cursor, school_id=None, kinds=TENANT_DATA_KINDS):
+    """Advance a school's (or every school's) data versions after a write.
+
+    Must run inside the write transaction so the new versions commit with
+    the data they describe. Returns the new {kind: version} of one school.
+    """
+    schools = 'SELECT id FROM schools' if school_id is None else 'SELECT ? AS id'
+    params = () if school_id is None else (school_id,)
+    versions = {}
+    for kind in kinds:
+        # WHERE true keeps SQLite from reading ON CONFLICT as a join clause
+        cursor.execute(f'''
+            INSERT INTO tenant_versions (school_id, kind, version, updated_at)
+            SELECT id, ?, 1, {UNIX_NOW_SQL} FROM ({schools}) WHERE true
+            ON CONFLICT (school_id, kind)
+            DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+            RETURNING version
+        ''', (kind,) + params)
+        rows = cursor.fetchall()
+        if school_id is not None:
+            versions[kind] = rows[0][0]
+    return versions
+
+def _create_register_indexes(cursor):
+    """Indexes that serve the registers newest first, page by page"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_debits_register ON debits(school_id, financial_year, date_paid, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_credits_register ON credits(school_id, financial_year, date_received, id)')
+
+def _create_item_lookup_index(cursor):
+    """Index for fetching one budget item by its key"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_budget_item_key ON budget_items(school_id, financial_year, item_key)')
+
+def upgrade_schema():
+    """Bring an existing database up to the current schema (safe to re-run)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        _migrate_monthly_allocations(cursor)
+        _migrate_credit_line_items(cursor)
+        _create_item_balances(cursor)
+        _create_monthly_summary(cursor)
+        _create_tenant_versions(cursor)
+        _create_register_indexes(cursor)
+        _create_item_lookup_index(cursor)
+        _sync_document_sequences(cursor)
+        _backfill_document_numbers(cursor)
 
 def create_developer_account():
     """Create developer account if not exists"""
@@ -235,13 +1072,16 @@ def create_developer_account():
 
 def log_action(actor_type, actor_id, action, target_school_id=None, ip_address=None):
     """Log audit action - never fails, just logs errors"""
+    def _insert(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO audit_logs (actor_type, actor_id, action, target_school_id, ip_address)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (actor_type, actor_id, action, target_school_id, ip_address))
+        return cursor.lastrowid
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO audit_logs (actor_type, actor_id, action, target_school_id, ip_address)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (actor_type, actor_id, action, target_school_id, ip_address))
+        return run_write(_insert)
     except Exception as e:
         print(f"Warning: Failed to log action: {e}")
         # Don't raise - logging failure should not break the application
@@ -2,12 +2,147 @@
 Database helper functions for multi-tenant grant management
 Replaces JSON file operations with proper database queries
 """
-import json
-from database import get_db
+import time
 
+import database
+from database import (
+    get_read_db, insert_credit_line_items, allocate_document_numbers, bump_tenant_versions,
+    MONTHS, MONTH_COLUMNS, DOCUMENT_SEQUENCES
+)
+from db_session import read_db, run_write, request_cached
+from tenant_cache import tenant_cached, tenant_patch, invalidate_tenant, apply_tenant_change
+
+def _write(func, school_id, financial_year, *tags):
+    """Run a write and bump the school's versions of tags with it, then drop
+    this process's cached reads that depend on tags"""
+    versions = {}
+    def _apply(conn):
+        result = func(conn)
+        versions.update(bump_tenant_versions(conn.cursor(), school_id, tags))
+        return result
+
+    try:
+        result = run_write(_apply)
+    except Exception:
+        invalidate_tenant(school_id, financial_year, *tags)
+        raise
+    invalidate_tenant(school_id, financial_year, *tags, versions=versions)
+    return result
+
+def _write_change(func, school_id, kind):
+    """Run a write of one register row, then update this process's cached
+    reads with the row instead of dropping them.
+
+    func returns (result, financial_year, op, record) where record is the
+    row as the register read returns it, or None when nothing was written.
+    """
+    versions = {}
+    def _apply(conn):
+        outcome = func(conn)
+        versions.update(bump_tenant_versions(conn.cursor(), school_id, [kind]))
+        return outcome
+
+    started = time.monotonic()
+    try:
+        result, financial_year, op, record = run_write(_apply)
+    except Exception:
+        invalidate_tenant(school_id, None, kind)
+        raise
+    if record is None:
+        invalidate_tenant(school_id, None, kind, versions=versions)
+    else:
+        apply_tenant_change(school_id, financial_year, kind, op, record,
+                            started, time.monotonic(), versions)
+    return result
+
+def _register_key(record):
+    """Sort key of a credit/debit register row (the registers are newest first)"""
+    return record['date'], int(record['id'].split('_')[1])
+
+def _patch_register(register, op, record):
+    """Copy of a register with record inserted in order, or removed"""
+    if op == 'delete':
+        return [r for r in register if r['id'] != record['id']]
+    key = _register_key(record)
+    index = next((i for i, r in enumerate(register) if _register_key(r) < key), len(register))
+    return register[:index] + [record] + register[index:]
+
+def _patch_register_page(page, op, record, limit, before=None, after=None):
+    """Copy of the newest page of a register with record inserted or removed.
+
+    Only the first page (no cursors) is patched. Returns None when the page
+    would need rows that are not cached: any other page, or a delete from a
+    register with older rows than the page holds.
+    """
+    if before is not None or after is not None:
+        return None
+    if op == 'delete' and page['older'] is not None:
+        return None
+    rows = _patch_register(page['rows'], op, record)
+    more = page['older'] is not None or len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'rows': rows,
+        'older': _register_key(rows[-1]) if more else None,
+        'newer': None
+    }
+
+def _register_page(cursor, table, date_column, school_id, financial_year, limit, before, after):
+    """One page of a register, newest first, by keyset on (date, id).
+
+    before/after are (date, id) cursors: the page holds the rows just older
+    than before, or just newer than after, or the newest rows when neither
+    is given. Returns the rows and the cursors of the neighbouring pages
+    (None when there are no older/newer rows).
+    """
+    where = 'school_id = ? AND financial_year = ?'
+    params = [school_id, financial_year]
+    if after is not None:
+        where += f' AND ({date_column}, id) > (?, ?)'
+        params += list(after)
+        order = 'ASC'
+    else:
+        if before is not None:
+            where += f' AND ({date_column}, id) < (?, ?)'
+            params += list(before)
+        order = 'DESC'
+    cursor.execute(f'''
+        SELECT * FROM {table}
+        WHERE {where}
+        ORDER BY {date_column} {order}, id {order}
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after is not None:
+        rows.reverse()
+    keys = [(row[date_column], row['id']) for row in rows]
+    
+    if after is not None:
+        newer = keys[0] if more else None
+        older = keys[-1] if keys else after
+    else:
+        newer = keys[0] if before is not None and keys else before
+        older = keys[-1] if more else None
+    return rows, older, newer
+
+def _signed(op, amount):
+    return amount if op == 'insert' else -amount
+
+def _credited_items(op, credit):
+    """Signed credited amount per budget item of a credit's line items"""
+    amounts = {}
+    for li in credit['lineItems']:
+        if li['itemId'] is not None:
+            amounts[li['itemId']] = amounts.get(li['itemId'], 0) + _signed(op, li['amount'])
+    return amounts
+
+@request_cached
+@tenant_cached('settings')
 def get_school_settings(school_id, financial_year):
     """Get settings for specific school and financial year"""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM school_settings
@@ -36,7 +171,7 @@ def get_school_settings(school_id, financial_year):
 
 def save_school_settings(school_id, financial_year, settings_data):
     """Save settings for specific school and financial year"""
-    with get_db() as conn:
+    def _save(conn):
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO school_settings
@@ -58,14 +193,19 @@ def save_school_settings(school_id, financial_year, settings_data):
             settings_data.get('counterSign', ''),
             settings_data.get('counterAppointment', '')
         ))
+
+    _write(_save, school_id, financial_year, 'settings')
     return True
 
+@request_cached
+@tenant_cached('budget')
 def get_school_budget(school_id, financial_year):
     """Get budget for specific school and financial year"""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM budget_items
+        cursor.execute(f'''
+            SELECT *, ({' + '.join(MONTH_COLUMNS)}) AS monthly_total
+            FROM budget_items
             WHERE school_id = ? AND financial_year = ?
             ORDER BY template_row_id
         ''', (school_id, financial_year))
@@ -84,7 +224,8 @@ def get_school_budget(school_id, financial_year):
             item['subActivity'] = item['sub_activity']
             item['subItemDescription'] = item['sub_item_description']
             item['totalAllocation'] = item['total_allocation']
-            item['monthlyAllocations'] = json.loads(item['monthly_allocations']) if item['monthly_allocations'] else {}
+            item['monthlyAllocations'] = {month: row[column] or 0 for month, column in zip(MONTHS, MONTH_COLUMNS)}
+            item['monthlyTotal'] = item['monthly_total']
             items.append(item)
         
         return {
@@ -92,36 +233,64 @@ def get_school_budget(school_id, financial_year):
             'items': items
         }
 
+@request_cached
+def get_school_budget_item(school_id, financial_year, item_key):
+    """One budget item's description and allocation (None if unknown)"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT item_key, template_row_id, pow_no, pow_name, sub_activity,
+                   sub_item_description, code, total_allocation
+            FROM budget_items
+            WHERE school_id = ? AND financial_year = ? AND item_key = ?
+        ''', (school_id, financial_year, item_key))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row['item_key'],
+            'template_row_id': row['template_row_id'],
+            'powNo': row['pow_no'],
+            'powName': row['pow_name'],
+            'subActivity': row['sub_activity'],
+            'subItemDescription': row['sub_item_description'],
+            'code': row['code'],
+            'totalAllocation': row['total_allocation']
+        }
+
 def save_school_budget(school_id, financial_year, budget_data):
     """Save budget for specific school and financial year - INSERT OR REPLACE"""
-    try:
-        with get_db() as conn:
-            cursor = conn.cursor()
+    def _save(conn):
+        cursor = conn.cursor()
+        
+        # Use INSERT OR REPLACE to handle both new and existing rows
+        for item in budget_data.get('items', []):
+            template_row_id = item.get('template_row_id')
+            if not template_row_id:
+                continue
             
-            # Use INSERT OR REPLACE to handle both new and existing rows
-            for item in budget_data.get('items', []):
-                template_row_id = item.get('template_row_id')
-                if not template_row_id:
-                    continue
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO budget_items
-                    (school_id, financial_year, template_row_id, item_key, pow_no, pow_name, 
-                     sub_activity, sub_item_description, code, total_allocation, monthly_allocations)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    school_id,
-                    financial_year,
-                    template_row_id,
-                    item.get('id'),
-                    item.get('powNo'),
-                    item.get('powName'),
-                    item.get('subActivity'),
-                    item.get('subItemDescription'),
-                    item.get('code'),
-                    item.get('totalAllocation', 0),
-                    json.dumps(item.get('monthlyAllocations', {}))
-                ))
+            monthly = item.get('monthlyAllocations') or {}
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO budget_items
+                (school_id, financial_year, template_row_id, item_key, pow_no, pow_name, 
+                 sub_activity, sub_item_description, code, total_allocation, {', '.join(MONTH_COLUMNS)})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(MONTH_COLUMNS))})
+            ''', (
+                school_id,
+                financial_year,
+                template_row_id,
+                item.get('id'),
+                item.get('powNo'),
+                item.get('powName'),
+                item.get('subActivity'),
+                item.get('subItemDescription'),
+                item.get('code'),
+                item.get('totalAllocation', 0),
+                *(monthly.get(month, 0) or 0 for month in MONTHS)
+            ))
+
+    try:
+        _write(_save, school_id, financial_year, 'budget')
         return True
     except Exception as e:
         print(f"ERROR in save_school_budget: {e}")
@@ -129,98 +298,493 @@ def save_school_budget(school_id, financial_year, budget_data):
         traceback.print_exc()
         return False
 
+@request_cached
+@tenant_cached('credits')
 def get_school_credits(school_id, financial_year):
     """Get credits for specific school and financial year"""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM credits
             WHERE school_id = ? AND financial_year = ?
-            ORDER BY date_received DESC
+            ORDER BY date_received DESC, id DESC
         ''', (school_id, financial_year))
         rows = cursor.fetchall()
         
-        credits = []
-        for row in rows:
-            credit = {
-                'id': f"credit_{row['id']}",
-                'date': row['date_received'],
-                'month': row['month'],
-                'lineItems': json.loads(row['line_items']),
-                'remarks': row['remarks'],
-                'financialYear': row['financial_year']
-            }
-            credits.append(credit)
+        cursor.execute('''
+            SELECT credit_id, item_id, sub_item_description, code, amount
+            FROM credit_line_items
+            WHERE school_id = ? AND financial_year = ?
+            ORDER BY credit_id, line_no
+        ''', (school_id, financial_year))
+        line_items = {}
+        for li in cursor.fetchall():
+            line_items.setdefault(li['credit_id'], []).append(_line_item_from_row(li))
         
-        return credits
+        return [_credit_from_row(row, line_items.get(row['id'], [])) for row in rows]
+
+def _line_item_from_row(li):
+    return {
+        'itemId': li['item_id'],
+        'subItemDescription': li['sub_item_description'],
+        'code': li['code'],
+        'amount': li['amount']
+    }
+
+def _credit_from_row(row, line_items):
+    return {
+        'id': f"credit_{row['id']}",
+        'date': row['date_received'],
+        'month': row['month'],
+        'lineItems': line_items,
+        'remarks': row['remarks'],
+        'financialYear': row['financial_year']
+    }
+
+def _read_credit(cursor, school_id, credit_id):
+    """One credit with its line items, as get_school_credits returns it"""
+    cursor.execute('SELECT * FROM credits WHERE id = ? AND school_id = ?', (credit_id, school_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute('''
+        SELECT item_id, sub_item_description, code, amount FROM credit_line_items
+        WHERE credit_id = ? ORDER BY line_no
+    ''', (credit_id,))
+    return _credit_from_row(row, [_line_item_from_row(li) for li in cursor.fetchall()])
+
+@tenant_patch(get_school_credits, 'credits')
+def _patch_credits(credits, op, credit):
+    return _patch_register(credits, op, credit)
+
+@request_cached
+@tenant_cached('credits')
+def get_school_credits_page(school_id, financial_year, limit, before=None, after=None):
+    """One page of the credit register, newest first (see _register_page)"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        rows, older, newer = _register_page(cursor, 'credits', 'date_received', school_id,
+                                            financial_year, limit, before, after)
+        line_items = {}
+        if rows:
+            cursor.execute(f'''
+                SELECT credit_id, item_id, sub_item_description, code, amount
+                FROM credit_line_items
+                WHERE credit_id IN ({', '.join('?' * len(rows))})
+                ORDER BY credit_id, line_no
+            ''', [row['id'] for row in rows])
+            for li in cursor.fetchall():
+                line_items.setdefault(li['credit_id'], []).append(_line_item_from_row(li))
+        return {
+            'rows': [_credit_from_row(row, line_items.get(row['id'], [])) for row in rows],
+            'older': older,
+            'newer': newer
+        }
+
+@tenant_patch(get_school_credits_page, 'credits')
+def _patch_credits_page(page, op, credit, *args):
+    return _patch_register_page(page, op, credit, *args)
+
+CREDIT_EXPORT_HEADERS = ['Date', 'Month', 'Code', 'Sub Item Description', 'Amount (MWK)', 'Remarks']
+
+def iter_school_credits_export(school_id, financial_year, date_from=None, date_to=None, item_id=None,
+                               batch_size=500):
+    """Credit register rows for export (CREDIT_EXPORT_HEADERS), one per line
+    item, oldest first (read like iter_school_debits_export)"""
+    where, params = _export_filters('date_received', school_id, financial_year,
+                                    date_from, date_to, prefix='c.')
+    if item_id:
+        where += ' AND li.item_id = ?'
+        params.append(item_id)
+    return _iter_export(f'''
+        SELECT c.date_received, c.month, li.code, li.sub_item_description, li.amount, c.remarks
+        FROM credits c
+        JOIN credit_line_items li ON li.credit_id = c.id
+        WHERE {where}
+        ORDER BY c.date_received, c.id, li.line_no
+    ''', params, batch_size)
+
+@request_cached
+@tenant_cached('credits')
+def get_school_credited_by_item(school_id, financial_year):
+    """Total credited per budget item ({item_id: amount}) in one grouped query"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT item_id, SUM(amount) AS credited
+            FROM credit_line_items
+            WHERE school_id = ? AND financial_year = ?
+            GROUP BY item_id
+        ''', (school_id, financial_year))
+        return {row['item_id']: row['credited'] for row in cursor.fetchall()}
+
+@tenant_patch(get_school_credited_by_item, 'credits')
+def _patch_credited_by_item(credited, op, credit):
+    credited = dict(credited)
+    for item_id, amount in _credited_items(op, credit).items():
+        credited[item_id] = credited.get(item_id, 0) + amount
+    return credited
+
+@request_cached
+@tenant_cached('credits', 'debits')
+def get_school_monthly_summary(school_id, financial_year):
+    """Credited and spent per month (April..March) and year totals from monthly_summary"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT month, credited, spent FROM monthly_summary
+            WHERE school_id = ? AND financial_year = ?
+        ''', (school_id, financial_year))
+        rows = {row['month']: row for row in cursor.fetchall()}
+        return {
+            'credited': [rows[m]['credited'] if m in rows else 0 for m in MONTHS],
+            'spent': [rows[m]['spent'] if m in rows else 0 for m in MONTHS],
+            'totalCredited': sum(row['credited'] for row in rows.values()),
+            'totalSpent': sum(row['spent'] for row in rows.values()),
+        }
+
+def _patch_month(summary, column, total, month, amount):
+    summary = dict(summary, **{total: summary[total] + amount})
+    if month in MONTHS:
+        summary[column] = list(summary[column])
+        summary[column][MONTHS.index(month)] += amount
+    return summary
+
+@tenant_patch(get_school_monthly_summary, 'credits')
+def _patch_monthly_credits(summary, op, credit):
+    amount = _signed(op, sum(li['amount'] for li in credit['lineItems']))
+    return _patch_month(summary, 'credited', 'totalCredited', credit['month'], amount)
+
+@tenant_patch(get_school_monthly_summary, 'debits')
+def _patch_monthly_debits(summary, op, debit):
+    return _patch_month(summary, 'spent', 'totalSpent', debit['month'], _signed(op, debit['amount']))
+
+@request_cached
+@tenant_cached('credits', 'debits')
+def get_school_grand_totals(school_id, financial_year):
+    """Total credited and spent for the year (summed from the registers) and register sizes"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                (SELECT COALESCE(SUM(amount), 0) FROM credit_line_items
+                 WHERE school_id = ?1 AND financial_year = ?2) AS credited,
+                (SELECT COALESCE(SUM(amount), 0) FROM debits
+                 WHERE school_id = ?1 AND financial_year = ?2) AS spent,
+                (SELECT COUNT(*) FROM credits
+                 WHERE school_id = ?1 AND financial_year = ?2) AS credit_count,
+                (SELECT COUNT(*) FROM debits
+                 WHERE school_id = ?1 AND financial_year = ?2) AS debit_count
+        ''', (school_id, financial_year))
+        row = cursor.fetchone()
+        return {
+            'credited': float(row['credited']),
+            'spent': float(row['spent']),
+            'creditCount': row['credit_count'],
+            'debitCount': row['debit_count']
+        }
+
+@tenant_patch(get_school_grand_totals, 'credits')
+def _patch_grand_totals_credits(totals, op, credit):
+    return dict(totals,
+                credited=totals['credited'] + _signed(op, sum(li['amount'] for li in credit['lineItems'])),
+                creditCount=totals['creditCount'] + _signed(op, 1))
+
+@tenant_patch(get_school_grand_totals, 'debits')
+def _patch_grand_totals_debits(totals, op, debit):
+    return dict(totals,
+                spent=totals['spent'] + _signed(op, debit['amount']),
+                debitCount=totals['debitCount'] + _signed(op, 1))
+
+@request_cached
+@tenant_cached('budget', 'credits', 'debits')
+def get_school_ledger(school_id, financial_year):
+    """Budgeted, credited, spent and balance per budget item in one query.
+
+    Credited and spent come from the materialized budget_item_balances;
+    balance is credited less spent (funds available to spend).
+    """
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT b.item_key, b.pow_no, b.pow_name, b.sub_activity,
+                   b.sub_item_description, b.code, b.total_allocation,
+                   COALESCE(m.credited, 0) AS credited,
+                   COALESCE(m.spent, 0) AS spent
+            FROM budget_items b
+            LEFT JOIN budget_item_balances m
+                ON m.school_id = b.school_id AND m.financial_year = b.financial_year
+                AND m.item_key = b.item_key
+            WHERE b.school_id = ? AND b.financial_year = ?
+            ORDER BY b.template_row_id
+        ''', (school_id, financial_year))
+        
+        ledger = []
+        for row in cursor.fetchall():
+            budgeted = row['total_allocation'] or 0
+            ledger.append({
+                'id': row['item_key'],
+                'powNo': row['pow_no'],
+                'powName': row['pow_name'],
+                'subActivity': row['sub_activity'],
+                'subItemDescription': row['sub_item_description'],
+                'code': row['code'],
+                'budgeted': budgeted,
+                'credited': row['credited'],
+                'spent': row['spent'],
+                'balance': row['credited'] - row['spent']
+            })
+        return ledger
+
+def _patch_ledger(ledger, column, amounts):
+    patched = []
+    for item in ledger:
+        if item['id'] in amounts:
+            item = dict(item)
+            item[column] += amounts[item['id']]
+            item['balance'] = item['credited'] - item['spent']
+        patched.append(item)
+    return patched
+
+@tenant_patch(get_school_ledger, 'credits')
+def _patch_ledger_credits(ledger, op, credit):
+    return _patch_ledger(ledger, 'credited', _credited_items(op, credit))
+
+@tenant_patch(get_school_ledger, 'debits')
+def _patch_ledger_debits(ledger, op, debit):
+    return _patch_ledger(ledger, 'spent', {debit['itemId']: _signed(op, debit['amount'])})
+
+def get_school_item_balance(school_id, financial_year, item_key):
+    """Credited, spent and balance for one budget item (primary key lookup)"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT credited, spent FROM budget_item_balances
+            WHERE school_id = ? AND financial_year = ? AND item_key = ?
+        ''', (school_id, financial_year, item_key))
+        row = cursor.fetchone()
+        credited = row['credited'] if row else 0.0
+        spent = row['spent'] if row else 0.0
+        return {'credited': credited, 'spent': spent, 'balance': credited - spent}
+
+def get_school_data_version(school_id, kinds):
+    """Versions and last change time (Unix seconds, None if never written)
+    of the kinds of a school's data"""
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT kind, version, updated_at FROM tenant_versions
+            WHERE school_id = ? AND kind IN ({', '.join('?' * len(kinds))})
+        ''', (school_id, *kinds))
+        rows = {row['kind']: row for row in cursor.fetchall()}
+        return {
+            'versions': tuple(rows[kind]['version'] if kind in rows else 0 for kind in kinds),
+            'updatedAt': max((row['updated_at'] for row in rows.values()
+                              if row['updated_at'] is not None), default=None)
+        }
 
 def save_school_credit(school_id, financial_year, credit_data):
-    """Save credit for specific school"""
-    with get_db() as conn:
+    """Save credit for specific school - returns the new credit row id"""
+    def _insert(conn):
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO credits
             (school_id, financial_year, date_received, month, line_items, remarks)
-            VALUES (?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, '[]', ?)
         ''', (
             school_id, financial_year,
             credit_data.get('date'),
             credit_data.get('month'),
-            json.dumps(credit_data.get('lineItems', [])),
             credit_data.get('remarks', '')
         ))
-    return True
+        credit_id = cursor.lastrowid
+        insert_credit_line_items(cursor, credit_id, school_id, financial_year,
+                                 credit_data.get('lineItems', []))
+        return credit_id, financial_year, 'insert', _read_credit(cursor, school_id, credit_id)
+
+    return _write_change(_insert, school_id, 'credits')
 
 def delete_school_credit(school_id, credit_id):
     """Delete credit for specific school"""
     # Extract numeric ID from credit_id (format: credit_123)
     numeric_id = int(credit_id.replace('credit_', ''))
-    with get_db() as conn:
+    def _delete(conn):
         cursor = conn.cursor()
+        credit = _read_credit(cursor, school_id, numeric_id)
         cursor.execute('''
             DELETE FROM credits
             WHERE id = ? AND school_id = ?
         ''', (numeric_id, school_id))
-    return True
+        return True, credit and credit['financialYear'], 'delete', credit
 
+    return _write_change(_delete, school_id, 'credits')
+
+@request_cached
+@tenant_cached('debits')
 def get_school_debits(school_id, financial_year):
     """Get debits for specific school and financial year"""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM debits
             WHERE school_id = ? AND financial_year = ?
-            ORDER BY date_paid DESC
+            ORDER BY date_paid DESC, id DESC
         ''', (school_id, financial_year))
-        rows = cursor.fetchall()
-        
-        debits = []
-        for row in rows:
-            debit = {
-                'id': f"debit_{row['id']}",
-                'documentNumber': row['document_number'],
-                'date': row['date_paid'],
-                'month': row['month'],
-                'itemId': row['item_id'],
-                'subItemDescription': row['sub_item_description'],
-                'code': row['code'],
-                'description': row['description'],
-                'amount': row['amount'],
-                'amountWords': row['amount_words'],
-                'supplierName': row['supplier_name'],
-                'position': row['position'],
-                'looseMinuteNumber': row['loose_minute_number'],
-                'receiptNumber': row['receipt_number'],
-                'financialYear': row['financial_year']
-            }
-            debits.append(debit)
-        
-        return debits
+        return [_debit_from_row(row) for row in cursor.fetchall()]
+
+@request_cached
+@tenant_cached('debits')
+def get_school_debit(school_id, financial_year, debit_id):
+    """One debit of a school and year by id (primary key lookup, None if not found)"""
+    try:
+        numeric_id = int(debit_id.replace('debit_', ''))
+    except ValueError:
+        return None
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM debits
+            WHERE id = ? AND school_id = ? AND financial_year = ?
+        ''', (numeric_id, school_id, financial_year))
+        row = cursor.fetchone()
+        return _debit_from_row(row) if row else None
+
+DEBIT_EXPORT_HEADERS = [
+    'Date', 'Month', 'Voucher No', 'Code', 'Sub Item Description', 'Description',
+    'Payee / Supplier', 'Position', 'Amount (MWK)', 'Amount in Words', 'Loose Minute No', 'Receipt No'
+]
+
+def iter_school_debits_export(school_id, financial_year, date_from=None, date_to=None, item_id=None,
+                              batch_size=500):
+    """Debit register rows for export (DEBIT_EXPORT_HEADERS), oldest first.
+
+    Rows are fetched from the cursor in batches as they are consumed, on a
+    pooled connection of their own, so a streamed response can read them
+    after the request has returned.
+    """
+    where, params = _export_filters('date_paid', school_id, financial_year, date_from, date_to)
+    if item_id:
+        where += ' AND item_id = ?'
+        params.append(item_id)
+    return _iter_export(f'''
+        SELECT date_paid, month, document_number, code, sub_item_description, description,
+               supplier_name, position, amount, amount_words, loose_minute_number, receipt_number
+        FROM debits
+        WHERE {where}
+        ORDER BY date_paid, id
+    ''', params, batch_size)
+
+def _export_filters(date_column, school_id, financial_year, date_from, date_to, prefix=''):
+    where = f'{prefix}school_id = ? AND {prefix}financial_year = ?'
+    params = [school_id, financial_year]
+    if date_from:
+        where += f' AND {prefix}{date_column} >= ?'
+        params.append(date_from)
+    if date_to:
+        where += f' AND {prefix}{date_column} <= ?'
+        params.append(date_to)
+    return where, params
+
+def _iter_export(query, params, batch_size):
+    with get_read_db() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield list(row)
+
+def get_school_debits_for_documents(school_id, financial_year, month=None, date_from=None,
+                                    date_to=None, debit_ids=None):
+    """Debits of a school and year to print documents for, oldest first.
+
+    Filters by month, by a date_paid range (inclusive, either end may be
+    omitted) and/or by a list of debit ids; with no filter every debit of
+    the year is returned.
+    """
+    where = 'school_id = ? AND financial_year = ?'
+    params = [school_id, financial_year]
+    if month:
+        where += ' AND month = ?'
+        params.append(month)
+    if date_from:
+        where += ' AND date_paid >= ?'
+        params.append(date_from)
+    if date_to:
+        where += ' AND date_paid <= ?'
+        params.append(date_to)
+    if debit_ids is not None:
+        numeric_ids = [int(debit_id.replace('debit_', '')) for debit_id in debit_ids
+                       if debit_id.replace('debit_', '').isdigit()]
+        if not numeric_ids:
+            return []
+        where += f" AND id IN ({', '.join('?' * len(numeric_ids))})"
+        params += numeric_ids
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM debits
+            WHERE {where}
+            ORDER BY date_paid, id
+        ''', params)
+        return [_debit_from_row(row) for row in cursor.fetchall()]
+
+def _debit_from_row(row):
+    return {
+        'id': f"debit_{row['id']}",
+        'documentNumber': row['document_number'],
+        'date': row['date_paid'],
+        'month': row['month'],
+        'itemId': row['item_id'],
+        'subItemDescription': row['sub_item_description'],
+        'code': row['code'],
+        'description': row['description'],
+        'amount': row['amount'],
+        'amountWords': row['amount_words'],
+        'supplierName': row['supplier_name'],
+        'position': row['position'],
+        'looseMinuteNumber': row['loose_minute_number'],
+        'receiptNumber': row['receipt_number'],
+        'financialYear': row['financial_year']
+    }
+
+@tenant_patch(get_school_debits, 'debits')
+def _patch_debits(debits, op, debit):
+    return _patch_register(debits, op, debit)
+
+@request_cached
+@tenant_cached('debits')
+def get_school_debits_page(school_id, financial_year, limit, before=None, after=None):
+    """One page of the debit register, newest first (see _register_page)"""
+    with read_db() as conn:
+        rows, older, newer = _register_page(conn.cursor(), 'debits', 'date_paid', school_id,
+                                            financial_year, limit, before, after)
+        return {'rows': [_debit_from_row(row) for row in rows], 'older': older, 'newer': newer}
+
+@tenant_patch(get_school_debits_page, 'debits')
+def _patch_debits_page(page, op, debit, *args):
+    return _patch_register_page(page, op, debit, *args)
+
+# Document types numbered when a debit is saved, and their debit fields
+_SAVE_NUMBERED = (('gp10', 'documentNumber'), ('looseMinute', 'looseMinuteNumber'),
+                  ('receipt', 'receiptNumber'))
 
 def save_school_debit(school_id, financial_year, debit_data):
-    """Save debit for specific school"""
-    with get_db() as conn:
+    """Save debit for specific school - returns the new debit row id.
+
+    A missing documentNumber is allocated in the same transaction and set
+    on debit_data, as are the loose minute and receipt numbers when
+    DOCUMENT_NUMBERING is 'save'.
+    """
+    def _insert(conn):
         cursor = conn.cursor()
+        for doc_type, key in _SAVE_NUMBERED:
+            if doc_type != 'gp10' and database.DOCUMENT_NUMBERING != 'save':
+                continue
+            if not debit_data.get(key):
+                debit_data[key] = allocate_document_numbers(
+                    cursor, school_id, financial_year, doc_type)[0]
         cursor.execute('''
             INSERT INTO debits
             (school_id, financial_year, document_number, date_paid, month, item_id,
@@ -243,12 +807,16 @@ def save_school_debit(school_id, financial_year, debit_data):
             debit_data.get('looseMinuteNumber', ''),
             debit_data.get('receiptNumber', '')
         ))
-        return cursor.lastrowid
+        debit_id = cursor.lastrowid
+        cursor.execute('SELECT * FROM debits WHERE id = ?', (debit_id,))
+        return debit_id, financial_year, 'insert', _debit_from_row(cursor.fetchone())
+
+    return _write_change(_insert, school_id, 'debits')
 
 def update_school_debit(school_id, debit_id, updates):
     """Update debit for specific school"""
     numeric_id = int(debit_id.replace('debit_', ''))
-    with get_db() as conn:
+    def _update(conn):
         cursor = conn.cursor()
         
         # Build update query dynamically
@@ -266,49 +834,72 @@ def update_school_debit(school_id, debit_id, updates):
             values.extend([numeric_id, school_id])
             query = f"UPDATE debits SET {', '.join(fields)} WHERE id = ? AND school_id = ?"
             cursor.execute(query, values)
+
+    _write(_update, school_id, None, 'debits')
     return True
 
 def delete_school_debit(school_id, debit_id):
     """Delete debit for specific school"""
     numeric_id = int(debit_id.replace('debit_', ''))
-    with get_db() as conn:
+    def _delete(conn):
         cursor = conn.cursor()
         cursor.execute('''
             DELETE FROM debits
             WHERE id = ? AND school_id = ?
+            RETURNING *
         ''', (numeric_id, school_id))
-    return True
+        row = cursor.fetchone()
+        if row is None:
+            return True, None, 'delete', None
+        return True, row['financial_year'], 'delete', _debit_from_row(row)
+
+    return _write_change(_delete, school_id, 'debits')
 
 def get_next_document_number(school_id, financial_year, doc_type):
-    """Get next sequential document number for school"""
-    with get_db() as conn:
+    """Allocate the next sequential document number for school"""
+    return reserve_document_numbers(school_id, financial_year, doc_type)[0]
+
+def reserve_document_numbers(school_id, financial_year, doc_type, count=1):
+    """Allocate a block of consecutive document numbers for batch entry"""
+    return run_write(lambda conn: allocate_document_numbers(
+        conn.cursor(), school_id, financial_year, doc_type, count))
+
+def assign_debit_document_numbers(school_id, financial_year, debit_ids,
+                                  doc_types=('looseMinute', 'receipt')):
+    """Finalize listed debits: number those without a loose minute/receipt number.
+
+    Debits are numbered in register order (oldest first) from one block per
+    document type, all in a single write transaction that holds the write
+    lock from the first SELECT, so overlapping calls never number a debit
+    twice. Returns
+    {doc_type: {debit_id: number}} for the numbers allocated.
+    """
+    numeric_ids = [int(debit_id.replace('debit_', '')) for debit_id in debit_ids]
+    if not numeric_ids:
+        return {doc_type: {} for doc_type in doc_types}
+    def _assign(conn):
         cursor = conn.cursor()
-        
-        # Get current max number from debits table
-        if doc_type == 'gp10':
-            cursor.execute('''
-                SELECT MAX(CAST(document_number AS INTEGER)) as max_no
-                FROM debits
-                WHERE school_id = ? AND financial_year = ?
-                AND document_number GLOB '[0-9]*'
-            ''', (school_id, financial_year))
-        elif doc_type == 'looseMinute':
-            cursor.execute('''
-                SELECT MAX(CAST(loose_minute_number AS INTEGER)) as max_no
-                FROM debits
-                WHERE school_id = ? AND financial_year = ?
-                AND loose_minute_number GLOB '[0-9]*'
-            ''', (school_id, financial_year))
-        elif doc_type == 'receipt':
-            cursor.execute('''
-                SELECT MAX(CAST(receipt_number AS INTEGER)) as max_no
-                FROM debits
+        assigned = {}
+        for doc_type in doc_types:
+            _, number_column = DOCUMENT_SEQUENCES[doc_type]
+            cursor.execute(f'''
+                SELECT id FROM debits
                 WHERE school_id = ? AND financial_year = ?
-                AND receipt_number GLOB '[0-9]*'
-            ''', (school_id, financial_year))
-        
-        row = cursor.fetchone()
-        max_no = row['max_no'] if row and row['max_no'] else 0
-        next_no = max_no + 1
-        
-        return f"{next_no:04d}"
+                  AND id IN ({', '.join('?' * len(numeric_ids))})
+                  AND ({number_column} IS NULL OR {number_column} = '')
+                ORDER BY date_paid, id
+            ''', [school_id, financial_year] + numeric_ids)
+            unnumbered = [row['id'] for row in cursor.fetchall()]
+            assigned[doc_type] = {}
+            if not unnumbered:
+                continue
+            numbers = allocate_document_numbers(cursor, school_id, financial_year, doc_type,
+                                                len(unnumbered))
+            cursor.executemany(f'''
+                UPDATE debits SET {number_column} = ? WHERE id = ? AND school_id = ?
+            ''', [(number, row_id, school_id) for number, row_id in zip(numbers, unnumbered)])
+            assigned[doc_type] = {f"debit_{row_id}": number
+                                  for row_id, number in zip(unnumbered, numbers)}
+        return assigned
+
+    return _write(_assign, school_id, financial_year, 'debits')
@@ -0,0 +1,129 @@
+"""
+Request-scoped database session (unit of work) bound to Flask ``g``
+
+All db_helpers reads made while handling one request share a single pooled
+connection and a single read snapshot, so every total on a page is computed
+from the same data. Identical reads inside the request are memoized; any
+write made through ``run_write()`` clears the memo and ends the snapshot so
+later reads in the same request see the new data.
+
+Reads use the read-only pool and never take write locks; writes use the
+writer path (``database.run_write``). Outside a request (scripts,
+migrations, CLI) every read falls back to its own ``get_read_db()``
+connection.
+"""
+import copy
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+
+import database
+from database import get_read_db, get_pool
+
+
+class RequestSession:
+    """One read-only connection + read snapshot + read memo for a single request"""
+
+    def __init__(self):
+        self.conn = None
+        self.pool = None
+        self.memo = {}
+        self.snapshot_started = None
+        self.snapshot_taken = None
+        self.data_version = None
+
+    def connection(self):
+        """Get the request connection, starting the read snapshot on first use"""
+        if self.conn is None:
+            self.pool = get_pool(readonly=True)
+            self.conn = self.pool.acquire()
+        if not self.conn.in_transaction:
+            # PRAGMA data_version takes the snapshot, so it is known to lie
+            # between snapshot_started and snapshot_taken
+            self.snapshot_started = time.monotonic()
+            self.conn.execute('BEGIN')
+            self.data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            self.snapshot_taken = time.monotonic()
+        return self.conn
+
+    def invalidate(self):
+        """Forget memoized reads and end the snapshot after a write"""
+        self.memo.clear()
+        self.snapshot_started = None
+        self.snapshot_taken = None
+        if self.conn is not None and self.conn.in_transaction:
+            self.conn.rollback()
+
+    def close(self):
+        """Release the connection back to the pool"""
+        self.memo.clear()
+        if self.conn is not None:
+            self.pool.release(self.conn)
+            self.conn = None
+
+
+def get_session():
+    """Get the session for the current request, or None outside a request"""
+    if not has_request_context():
+        return None
+    if 'db_session' not in g:
+        g.db_session = RequestSession()
+    return g.db_session
+
+
+def close_session(exception=None):
+    """Teardown handler - release the request connection"""
+    db_session = g.pop('db_session', None)
+    if db_session is not None:
+        db_session.close()
+
+
+def init_app(app):
+    """Register the session teardown on the Flask app"""
+    app.teardown_appcontext(close_session)
+
+
+@contextmanager
+def read_db():
+    """Connection for reads: the request snapshot if inside a request"""
+    db_session = get_session()
+    if db_session is None:
+        with get_read_db() as conn:
+            yield conn
+        return
+    yield db_session.connection()
+
+
+def run_write(func):
+    """Run a write on the writer path, then refresh the request session"""
+    try:
+        return database.run_write(func)
+    finally:
+        invalidate_session()
+
+
+def invalidate_session():
+    """Drop memoized reads for the current request (no-op outside a request)"""
+    db_session = get_session()
+    if db_session is not None:
+        db_session.invalidate()
+
+
+def request_cached(func):
+    """Memoize a read helper for the rest of the current request.
+
+    Callers get their own copy of the result, so mutating it does not leak
+    into later calls.
+    """
+    @wraps(func)
+    def wrapper(*args):
+        db_session = get_session()
+        if db_session is None:
+            return func(*args)
+        key = (func.__name__,) + args
+        if key not in db_session.memo:
+            db_session.memo[key] = func(*args)
+        return copy.deepcopy(db_session.memo[key])
+    return wrapper
@@ -0,0 +1,166 @@
+"""
+District-wide budget-versus-actual export across all schools
+
+Developers can export one workbook for a financial year holding a summary
+sheet (one row per school and district totals) and one sheet per school
+(budgeted, credited, spent and balances per budget item).
+
+An export runs as a background job in a thread of the web worker. A pool
+of threads reads the schools' ledgers and turns them into sheet rows (the
+SQLite queries release the GIL, so reads overlap), while the job thread
+writes each school's sheet as soon as its rows are ready, in school order.
+Threads rather than processes keep the job inside the worker that already
+has the app and its database set up. Job progress and the finished file
+live in a job directory on disk, so any worker process can report on or
+serve a job started by another.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+DISTRICT_EXPORT_DIR = os.environ.get('DISTRICT_EXPORT_DIR', os.path.join('data', 'district_exports'))
+DISTRICT_EXPORT_WORKERS = int(os.environ.get('DISTRICT_EXPORT_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Finished jobs older than this are removed when a new job starts
+DISTRICT_EXPORT_KEEP_HOURS = 24
+
+SCHOOL_HEADERS = ['POW No', 'POW Name', 'Sub Item Description', 'Code', 'Budgeted', 'Credited',
+                  'Spent', 'Budget Balance', 'Funds Available']
+SUMMARY_HEADERS = ['School', 'Budgeted', 'Credited', 'Spent', 'Budget Balance', 'Funds Available']
+
+
+def school_sheet(school_id, financial_year):
+    """Rows of one school's sheet and its totals (runs in a pool thread)"""
+    from ledger import build_ledger_snapshot
+    snapshot = build_ledger_snapshot(school_id, financial_year)
+    rows = [[item['powNo'], item['powName'], item['subItemDescription'], item['code'],
+             item['budgeted'], item['credited'], item['spent'],
+             item['budgeted'] - item['spent'], item['balance']]
+            for item in snapshot.items]
+    totals = snapshot.totals
+    return {
+        'rows': rows,
+        'totals': [totals['budgeted'], totals['credited'], totals['spent'],
+                   totals['budgeted'] - totals['spent'], totals['balance']]
+    }
+
+
+def _job_dir(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        return None
+    return os.path.join(DISTRICT_EXPORT_DIR, job_id)
+
+
+def _write_status(job_id, **status):
+    path = os.path.join(_job_dir(job_id), 'status.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+
+def get_job(job_id):
+    """Status of a job: state ('running', 'done' or 'failed'), done/total
+    schools, and the file name once done (None if there is no such job)"""
+    job_dir = _job_dir(job_id)
+    if job_dir is None:
+        return None
+    try:
+        with open(os.path.join(job_dir, 'status.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def job_file(job_id):
+    """Path of a finished job's workbook, or None"""
+    status = get_job(job_id)
+    if not status or status['state'] != 'done':
+        return None
+    return os.path.join(_job_dir(job_id), status['filename'])
+
+
+def _remove_old_jobs():
+    cutoff = time.time() - DISTRICT_EXPORT_KEEP_HOURS * 3600
+    try:
+        names = os.listdir(DISTRICT_EXPORT_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        job_dir = os.path.join(DISTRICT_EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(job_dir) < cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+
+
+def start_export(financial_year, schools):
+    """Start exporting schools ([(school_id, school_name)]); returns the job id"""
+    _remove_old_jobs()
+    job_id = uuid.uuid4().hex
+    os.makedirs(_job_dir(job_id))
+    _write_status(job_id, state='running', done=0, total=len(schools), filename=None, error=None)
+    threading.Thread(target=run_export, args=(job_id, financial_year, schools),
+                     name=f'district-export-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+
+def _sheet_title(name, used):
+    """An Excel sheet name for a school: at most 31 characters, none of []:*?/\\, unique"""
+    base = re.sub(r'[\[\]:*?/\\]', ' ', name).strip()[:31] or 'School'
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f' ({n})'
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def run_export(job_id, financial_year, schools, max_workers=None):
+    """Build the workbook of a job, recording progress as schools complete"""
+    from excel_export import new_workbook, new_sheet, cell, styled_row
+
+    done = 0
+    try:
+        wb = new_workbook()
+        summary = new_sheet(wb, 'District Summary', [40, 14, 14, 14, 16, 16])
+        summary.append([cell(summary, f'DISTRICT BUDGET VS ACTUAL | Financial Year: {financial_year}', 'title')])
+        summary.append([])
+        summary.append(styled_row(summary, SUMMARY_HEADERS, 'header'))
+        district = [0.0] * 5
+        used = {'district summary'}
+
+        with ThreadPoolExecutor(max_workers=max_workers or DISTRICT_EXPORT_WORKERS,
+                                thread_name_prefix=f'district-export-{job_id[:8]}') as pool:
+            results = pool.map(school_sheet, [school_id for school_id, _ in schools],
+                               [financial_year] * len(schools))
+            for (school_id, school_name), result in zip(schools, results):
+                summary.append(styled_row(summary, [school_name], 'text') +
+                               styled_row(summary, result['totals'], 'number'))
+                district = [a + b for a, b in zip(district, result['totals'])]
+
+                ws = new_sheet(wb, _sheet_title(school_name, used), [8, 35, 40, 12, 14, 14, 14, 16, 16])
+                ws.append([cell(ws, f'{school_name} | Financial Year: {financial_year}', 'title')])
+                ws.append([])
+                ws.append(styled_row(ws, SCHOOL_HEADERS, 'header'))
+                for row in result['rows']:
+                    ws.append(styled_row(ws, row[:4], 'text') + styled_row(ws, row[4:], 'number'))
+                ws.append([None, None, cell(ws, 'TOTALS', 'label'), None] +
+                          styled_row(ws, result['totals'], 'total'))
+                done += 1
+                _write_status(job_id, state='running', done=done, total=len(schools),
+                              filename=None, error=None)
+        summary.append([cell(summary, 'DISTRICT TOTALS', 'label')] + styled_row(summary, district, 'total'))
+
+        filename = f"District_Budget_vs_Actual_{financial_year.replace('/', '-')}.xlsx"
+        wb.save(os.path.join(_job_dir(job_id), filename))
+        _write_status(job_id, state='done', done=done, total=len(schools),
+                      filename=filename, error=None)
+    except Exception as e:
+        print(f"District export {job_id} failed: {e}")
+        _write_status(job_id, state='failed', done=done, total=len(schools),
+                      filename=None, error=str(e))
@@ -0,0 +1,124 @@
+"""
+Write-only Excel export engine
+
+Exports are built with openpyxl's write-only mode: rows are appended once
+and flushed to a temporary file as they are written, so memory stays flat
+however many rows a workbook has. Cell formatting uses named styles that
+are registered once per workbook instead of a Font/Border/Alignment per
+cell, and the government logo is read from disk once per process.
+
+The finished workbook is saved to a spooled temporary file (kept in memory
+while small, moved to disk when large) and sent to the client in chunks.
+"""
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Bytes per chunk sent to the client, and the size a saved workbook may
+# reach in memory before it is spooled to disk
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'static', 'images', 'Malawi Government logo.png')
+
+_THIN = Side(style='thin')
+_BOX = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_CENTER = Alignment(horizontal='center', vertical='center', wrap_text=True)
+
+# Named styles shared by every export: name -> NamedStyle keyword arguments
+STYLES = {
+    'title': {'font': Font(bold=True, size=14), 'alignment': _CENTER},
+    'subtitle': {'font': Font(size=10), 'alignment': _CENTER},
+    'header': {'font': Font(color='FFFFFF', bold=True, size=10), 'border': _BOX, 'alignment': _CENTER,
+               'fill': PatternFill(start_color='1F2937', end_color='1F2937', fill_type='solid')},
+    'text': {'border': _BOX},
+    'number': {'border': _BOX, 'alignment': Alignment(horizontal='right')},
+    'label': {'font': Font(bold=True)},
+    'total': {'font': Font(bold=True), 'border': _BOX,
+              'fill': PatternFill(start_color='E5E7EB', end_color='E5E7EB', fill_type='solid')},
+}
+
+
+def new_workbook():
+    """Write-only workbook with the export named styles registered"""
+    wb = Workbook(write_only=True)
+    for name, attributes in STYLES.items():
+        wb.add_named_style(NamedStyle(name=name, **attributes))
+    return wb
+
+
+def new_sheet(wb, title, widths):
+    """Add a sheet with its column widths (must be set before any row)"""
+    ws = wb.create_sheet(title)
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    return ws
+
+
+def cell(ws, value, style=None):
+    """A cell for ws.append(), formatted with one of STYLES"""
+    c = WriteOnlyCell(ws, value)
+    if style:
+        c.style = style
+    return c
+
+
+def styled_row(ws, values, style):
+    """Cells for ws.append(), all formatted with one style"""
+    return [cell(ws, value, style) for value in values]
+
+
+@lru_cache(maxsize=1)
+def _logo_bytes():
+    try:
+        with open(LOGO_PATH, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        print(f"Could not read logo: {e}")
+        return None
+
+
+def add_logo(ws, anchor, size=60):
+    """Anchor the government logo at a cell (skipped if the file is missing)"""
+    data = _logo_bytes()
+    if data is None:
+        return
+    try:
+        img = XLImage(BytesIO(data))
+    except Exception as e:
+        print(f"Could not add logo: {e}")
+        return
+    img.height = size
+    img.width = size
+    ws.add_image(img, anchor)
+
+
+def save_workbook(wb):
+    """Save a workbook to a spooled temporary file; returns (file rewound, size)"""
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    wb.save(output)
+    size = output.tell()
+    output.seek(0)
+    return output, size
+
+
+def iter_file(f, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a file's contents in chunks, closing it at the end"""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
@@ -0,0 +1,149 @@
+"""
+On-disk cache of export files, keyed by the data they were built from
+
+Budget and register exports are rebuilt from scratch on every download,
+although around reporting deadlines the same school downloads the same
+report many times over. The finished file of an export is therefore kept
+on disk under a key naming the school, financial year, export and the
+tenant_versions of the data it reads: any write to that data moves the
+version, so a stale file is never found again and is left to eviction.
+
+Each entry is a directory named after the key's digest holding the one
+file under its download name. Entries are published with an atomic
+rename, so worker processes can share the directory. The cache is bounded
+by total size (EXPORT_CACHE_MB, 0 disables it) and the least recently
+used entries are removed first.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join('data', 'export_cache'))
+EXPORT_CACHE_MB = int(os.environ.get('EXPORT_CACHE_MB', '0'))
+
+
+class ExportCache:
+    """Size-bounded LRU of export files in a directory"""
+
+    def __init__(self, directory=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key):
+        """Path of the cached file for key, or None"""
+        path = self._find(key)
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def _find(self, key):
+        entry = self._entry_dir(key)
+        try:
+            path = os.path.join(entry, os.listdir(entry)[0])
+            # The modification time records the last use
+            os.utime(path)
+        except (FileNotFoundError, IndexError):
+            return None
+        return path
+
+    def put(self, key, filename, chunks):
+        """Store the file made of chunks (bytes) under key; returns its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.tmp', dir=self.directory)
+        try:
+            with open(os.path.join(staging, filename), 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            entry = self._entry_dir(key)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # Another worker stored the same export first
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        with self._lock:
+            self.stores += 1
+        self.evict(keep=entry)
+        return self._find(key) or os.path.join(entry, filename)
+
+    def _entries(self):
+        """(last used, size, entry dir) of every published entry"""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith('.tmp'):
+                continue
+            entry = os.path.join(self.directory, name)
+            try:
+                for file_name in os.listdir(entry):
+                    stat = os.stat(os.path.join(entry, file_name))
+                    entries.append((stat.st_mtime, stat.st_size, entry))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_bytes,
+        never the entry dir keep (the one just stored)"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        """Remove every entry"""
+        for _, _, entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def stats(self):
+        """Hit/miss counters and disk usage"""
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'files': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'stores': self.stores,
+                'evictions': self.evictions
+            }
+
+
+_cache = ExportCache()
+
+
+def get_export_cache():
+    """The export cache of this worker process"""
+    return _cache
@@ -0,0 +1,99 @@
+"""
+Ledger snapshot - every aggregate the register and dashboard pages show
+
+One LedgerSnapshot is built per school, financial year and data version
+and shared by the grant summary, credits, debits and tracking pages, so
+they all report the same budgeted, credited, spent and balance figures.
+"""
+from database import MONTHS
+from db_helpers import get_school_ledger, get_school_monthly_summary, get_school_grand_totals
+from db_session import request_cached
+
+
+class LedgerSnapshot:
+    """Per-item, per-POW, per-month and grand totals for one school and year.
+
+    Item balances are credited less spent (funds available to spend);
+    spending rows report budgeted less spent. Grand totals are summed from the
+    credit and debit registers, so they also count credit lines with no
+    budget item, which the per-item rows leave out.
+    """
+
+    def __init__(self, school_id, financial_year, items, monthly, grand_totals):
+        self.school_id = school_id
+        self.financial_year = financial_year
+        self.items = items
+        self.by_item = {item['id']: item for item in items}
+        self.months = [{'month': month, 'credited': credited, 'spent': spent}
+                       for month, credited, spent in zip(MONTHS, monthly['credited'], monthly['spent'])]
+        self.monthly_credited = monthly['credited']
+        self.monthly_spent = monthly['spent']
+
+        self.pows = []
+        pows_by_no = {}
+        for item in items:
+            pow_totals = pows_by_no.get(item['powNo'])
+            if pow_totals is None:
+                pow_totals = {'powNo': item['powNo'], 'powName': item['powName'],
+                              'budgeted': 0.0, 'credited': 0.0, 'spent': 0.0}
+                pows_by_no[item['powNo']] = pow_totals
+                self.pows.append(pow_totals)
+            for key in ('budgeted', 'credited', 'spent'):
+                pow_totals[key] += item[key]
+        for pow_totals in self.pows:
+            pow_totals['balance'] = pow_totals['credited'] - pow_totals['spent']
+
+        self.totals = {
+            'budgeted': sum((item['budgeted'] for item in items), 0.0),
+            'credited': grand_totals['credited'],
+            'spent': grand_totals['spent'],
+        }
+        self.totals['balance'] = self.totals['credited'] - self.totals['spent']
+        self.counts = {'credits': grand_totals['creditCount'], 'debits': grand_totals['debitCount']}
+
+    @classmethod
+    def empty(cls, financial_year):
+        """Snapshot with no data (no school logged in)"""
+        return cls(None, financial_year, [], {'credited': [0] * 12, 'spent': [0] * 12},
+                   {'credited': 0.0, 'spent': 0.0, 'creditCount': 0, 'debitCount': 0})
+
+    def item(self, item_id):
+        """Totals for one budget item (zeros if the item is unknown)"""
+        return self.by_item.get(item_id) or {
+            'id': item_id, 'budgeted': 0.0, 'credited': 0.0, 'spent': 0.0, 'balance': 0.0
+        }
+
+    @property
+    def spending(self):
+        """Tracking rows: allocation, spent and allocation left per item"""
+        return [{
+            'id': item['id'],
+            'powNo': item['powNo'],
+            'powName': item['powName'],
+            'subActivity': item['subActivity'],
+            'subItemDescription': item['subItemDescription'],
+            'code': item['code'],
+            'totalAllocation': item['budgeted'],
+            'spent': item['spent'],
+            'balance': item['budgeted'] - item['spent']
+        } for item in self.items]
+
+
+def build_ledger_snapshot(school_id, financial_year):
+    """Read the aggregates for a school and year and build a snapshot"""
+    return LedgerSnapshot(
+        school_id, financial_year,
+        get_school_ledger(school_id, financial_year),
+        get_school_monthly_summary(school_id, financial_year),
+        get_school_grand_totals(school_id, financial_year)
+    )
+
+
+@request_cached
+def get_ledger_snapshot(school_id, financial_year):
+    """Snapshot for a school and year, built once per request.
+
+    The request memo is cleared by every write, so a snapshot never outlives
+    the data version it was built from.
+    """
+    return build_ledger_snapshot(school_id, financial_year)
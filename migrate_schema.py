@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+Database Migration: Bring an existing database up to the current schema
+- budget monthly allocations in per-month REAL columns
+- credit line items in the credit_line_items table
+"""
+from database import upgrade_schema
+
+if __name__ == '__main__':
+    upgrade_schema()
+    print("Migration completed!")
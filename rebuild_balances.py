@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Rebuild or verify the materialized totals kept by triggers:
+per-item balances (budget_item_balances) and per-month totals (monthly_summary)
+
+Usage:
+    python rebuild_balances.py            # recompute from the registers
+    python rebuild_balances.py --verify   # report drift without changing data
+"""
+import sys
+
+from database import (
+    get_db, rebuild_item_balances, verify_item_balances,
+    rebuild_monthly_summary, verify_monthly_summary, bump_tenant_versions
+)
+
+# (label, key column, rebuild, verify)
+SUMMARIES = [
+    ('item balances', 'item_key', rebuild_item_balances, verify_item_balances),
+    ('monthly totals', 'month', rebuild_monthly_summary, verify_monthly_summary),
+]
+
+def main():
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if '--verify' in sys.argv:
+            status = 0
+            for label, key_column, _, verify in SUMMARIES:
+                mismatches = verify(cursor)
+                if not mismatches:
+                    print(f"✅ {label.capitalize()} match the credit and debit registers")
+                    continue
+                status = 1
+                print(f"❌ {len(mismatches)} {label} differ from the registers:")
+                for row in mismatches:
+                    print(f"   school {row['school_id']} {row['financial_year']} {row[key_column]}: "
+                          f"credited {row['stored_credited']:,.2f} (actual {row['actual_credited']:,.2f}), "
+                          f"spent {row['stored_spent']:,.2f} (actual {row['actual_spent']:,.2f})")
+            return status
+
+        for label, _, rebuild, _ in SUMMARIES:
+            count = rebuild(cursor)
+            print(f"✅ Rebuilt {count} {label}")
+        # Running workers drop their cached ledgers on their next request
+        bump_tenant_versions(cursor, kinds=('credits', 'debits'))
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+In-process LRU cache of per-tenant reads, keyed by (school_id, financial_year)
+
+Register pages are mostly re-opened without anything changing in between,
+so the db_helpers reads for a school and year are kept in memory until one
+of the db_helpers writes invalidates them. Each cached read is tagged with
+the kinds of data it depends on ('settings', 'budget', 'credits', 'debits')
+and a write only drops the reads that depend on what it changed.
+
+Posting or deleting a single credit or debit does not drop the cached
+reads: the functions registered with ``tenant_patch()`` apply the row to
+them (adjusting totals, inserting the row into a register) so the page
+reloaded after the post is still served from the cache.
+
+Writes made by other worker processes are caught through the database:
+every db_helpers write bumps the school's row of each kind it changed in
+tenant_versions, in the same transaction. The first cached read of a
+school in a request checks ``PRAGMA data_version`` on the request
+connection; only when some other connection has committed since that
+connection last looked is the school's tenant_versions row read, and the
+reads of kinds whose version moved are dropped.
+
+The cache is bounded by the number of tenants held (TENANT_CACHE_SIZE, 0
+disables it) and the least recently used tenant is evicted first. Each
+tenant holds at most TENANT_CACHE_ENTRIES reads (one per reader and
+arguments, so every register page is one), again least recently used
+first. It is
+only used while handling a request; scripts and migrations always read the
+database directly.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from db_session import get_session
+
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', '0'))
+TENANT_CACHE_ENTRIES = int(os.environ.get('TENANT_CACHE_ENTRIES', '64'))
+
+# A cached read and the bounds of the snapshot it was read from
+_Entry = namedtuple('_Entry', 'tags value started taken')
+
+# (reader name, kind) -> function(value, op, record, *args) returning the new value
+_patchers = {}
+
+
+class TenantCache:
+    """Bounded LRU of read results per (school_id, financial_year)"""
+
+    def __init__(self, max_tenants=TENANT_CACHE_SIZE, max_entries=TENANT_CACHE_ENTRIES):
+        self.max_tenants = max_tenants
+        self.max_entries = max_entries
+        self._tenants = OrderedDict()
+        self._invalidated_at = {}
+        self._versions = {}
+        self._data_versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.updates = 0
+        self.version_checks = 0
+        self.unchanged_checks = 0
+
+    def get(self, school_id, financial_year, key, tags, loader, started=None, taken=None):
+        """Return the cached value for key, loading and storing it on a miss.
+
+        The data loader reads from was snapshotted between started and
+        taken; a value read before the school's last invalidation is
+        returned but not kept.
+        """
+        tenant = (school_id, financial_year)
+        with self._lock:
+            entries = self._tenants.get(tenant)
+            if entries is not None and key in entries:
+                self._tenants.move_to_end(tenant)
+                entries.move_to_end(key)
+                self.hits += 1
+                return entries[key].value
+            self.misses += 1
+        if started is None:
+            started = time.monotonic()
+
+        value = loader()
+
+        with self._lock:
+            if self._invalidated_at.get(school_id, float('-inf')) >= started:
+                return value
+            entries = self._tenants.get(tenant)
+            if entries is None:
+                entries = self._tenants[tenant] = OrderedDict()
+            self._tenants.move_to_end(tenant)
+            entries[key] = _Entry(frozenset(tags), value, started,
+                                  float('inf') if taken is None else taken)
+            entries.move_to_end(key)
+            while len(entries) > max(self.max_entries, 1):
+                entries.popitem(last=False)
+                self.evictions += 1
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def validate(self, conn, data_version, school_id):
+        """Drop cached reads of a school that other processes have changed.
+
+        conn is the request connection inside its read transaction and
+        data_version what it reported for that snapshot; the versions read
+        through it are those of the request snapshot. Returns False when
+        that snapshot is older than what the cache already holds, in which
+        case the request must not use the cache for the school.
+        """
+        with self._lock:
+            seen = self._data_versions.get(id(conn))
+            if (seen is not None and seen[0] is conn and seen[1] == data_version
+                    and school_id in seen[2]):
+                self.unchanged_checks += 1
+                return True
+
+        cursor = conn.execute('''
+            SELECT kind, version FROM tenant_versions WHERE school_id = ?
+        ''', (school_id,))
+        versions = {row['kind']: row['version'] for row in cursor.fetchall()}
+
+        with self._lock:
+            self.version_checks += 1
+            known = self._versions.get(school_id)
+            if known is None:
+                # Nothing can be cached for a school not seen before
+                self._versions[school_id] = versions
+            else:
+                if any(version < known.get(kind, 0) for kind, version in versions.items()):
+                    return False
+                changed = [kind for kind, version in versions.items()
+                           if version > known.get(kind, 0)]
+                # Deleting a school removes its versions with its data
+                dropped = [kind for kind in known if kind not in versions]
+                if changed or dropped:
+                    for kind in dropped:
+                        del known[kind]
+                    known.update((kind, versions[kind]) for kind in changed)
+                    self._invalidate(school_id, None, changed + dropped)
+
+            seen = self._data_versions.get(id(conn))
+            if seen is None or seen[0] is not conn or seen[1] != data_version:
+                if len(self._data_versions) >= 64:
+                    self._data_versions.clear()
+                seen = self._data_versions[id(conn)] = (conn, data_version, set())
+            seen[2].add(school_id)
+        return True
+
+    def invalidate(self, school_id, financial_year=None, tags=None, versions=None):
+        """Drop cached reads of a school (one year or all) that depend on tags.
+
+        versions are the tenant_versions a committed write of this process
+        moved to; when nothing else was written in between they become the
+        known versions, so the next validation does not drop reads again.
+        """
+        with self._lock:
+            self._invalidate(school_id, financial_year, tags)
+            self._advance_versions(school_id, versions)
+
+    def apply(self, school_id, financial_year, kind, op, record, started, finished, versions=None):
+        """Bring cached reads up to date with one committed row change.
+
+        The write ran between started and finished. Reads snapshotted before
+        it started get the change applied by their patcher; reads that may
+        already include it, or that have no patcher for kind, are dropped.
+        """
+        with self._lock:
+            self._invalidated_at[school_id] = max(
+                self._invalidated_at.get(school_id, float('-inf')), finished)
+            entries = self._tenants.get((school_id, financial_year), {})
+            for key, entry in list(entries.items()):
+                if kind not in entry.tags or entry.started > finished:
+                    continue
+                patcher = _patchers.get((key[0], kind))
+                if patcher is not None and entry.taken < started:
+                    try:
+                        value = patcher(entry.value, op, record, *key[1:])
+                        if value is not None:
+                            entries[key] = entry._replace(value=value)
+                            self.updates += 1
+                            continue
+                    except Exception as e:
+                        print(f"Warning: could not update cached {key[0]}: {e}")
+                del entries[key]
+                self.invalidations += 1
+            if not entries:
+                self._tenants.pop((school_id, financial_year), None)
+            self._advance_versions(school_id, versions)
+
+    def _invalidate(self, school_id, financial_year, tags):
+        self._invalidated_at[school_id] = time.monotonic()
+        tenants = [t for t in self._tenants
+                   if t[0] == school_id and financial_year in (None, t[1])]
+        for tenant in tenants:
+            entries = self._tenants[tenant]
+            stale = [key for key, entry in entries.items()
+                     if tags is None or entry.tags & set(tags)]
+            for key in stale:
+                del entries[key]
+            self.invalidations += len(stale)
+            if not entries:
+                del self._tenants[tenant]
+
+    def _advance_versions(self, school_id, versions):
+        known = self._versions.get(school_id)
+        if known is not None and versions:
+            for kind, version in versions.items():
+                if known.get(kind, 0) == version - 1:
+                    known[kind] = version
+
+    def clear(self):
+        """Drop everything"""
+        with self._lock:
+            now = time.monotonic()
+            for school_id in self._invalidated_at:
+                self._invalidated_at[school_id] = now
+            self._tenants.clear()
+            self._data_versions.clear()
+
+    def stats(self):
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_tenants': self.max_tenants,
+                'max_entries': self.max_entries,
+                'tenants': len(self._tenants),
+                'entries': sum(len(entries) for entries in self._tenants.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'updates': self.updates,
+                'version_checks': self.version_checks,
+                'unchanged_checks': self.unchanged_checks
+            }
+
+
+_cache = TenantCache()
+
+
+def get_tenant_cache():
+    """The cache of this worker process"""
+    return _cache
+
+
+def tenant_cached(*tags):
+    """Cache a read helper taking (school_id, financial_year, ...) per tenant.
+
+    tags name the data the read depends on; writes passing any of them to
+    invalidate_tenant() drop the cached result.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(school_id, financial_year, *args):
+            db_session = get_session()
+            if _cache.max_tenants <= 0 or db_session is None:
+                return func(school_id, financial_year, *args)
+            conn = db_session.connection()
+            validated = ('tenant_validated', school_id)
+            if validated not in db_session.memo:
+                db_session.memo[validated] = _cache.validate(conn, db_session.data_version, school_id)
+            if not db_session.memo[validated]:
+                return func(school_id, financial_year, *args)
+            return _cache.get(school_id, financial_year, (func.__name__,) + args, tags,
+                              lambda: func(school_id, financial_year, *args),
+                              db_session.snapshot_started, db_session.snapshot_taken)
+        return wrapper
+    return decorator
+
+
+def tenant_patch(reader, kind):
+    """Register how a posted or deleted row of kind changes reader's cached result.
+
+    The decorated function takes (value, op, record, *args) with op 'insert'
+    or 'delete', record the row as the register read returns it and args the
+    reader's arguments after (school_id, financial_year). It returns the new
+    value without modifying the old one, or None when the change cannot be
+    applied from the cached value alone (the read is then dropped).
+    """
+    def decorator(func):
+        _patchers[(reader.__name__, kind)] = func
+        return func
+    return decorator
+
+
+def invalidate_tenant(school_id, financial_year=None, *tags, versions=None):
+    """Forget cached reads after a write (all years/tags when not given)"""
+    _cache.invalidate(school_id, financial_year, tags or None, versions)
+
+
+def apply_tenant_change(school_id, financial_year, kind, op, record, started, finished,
+                        versions=None):
+    """Update cached reads after a write of one row (see TenantCache.apply)"""
+    _cache.apply(school_id, financial_year, kind, op, record, started, finished, versions)
@@ -4,10 +4,20 @@ Test Suite for Grant Management System - Python Version
 """
 
 import unittest
+import io
 import json
 import tempfile
 import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import export_cache
 from app import app
+from db_helpers import save_school_settings, save_school_budget, save_school_credit, save_school_debit, get_school_debits
 
 class GrantManagementTestCase(unittest.TestCase):
     
@@ -193,5 +203,466 @@ class GrantManagementTestCase(unittest.TestCase):
         # Should handle missing fields gracefully
         self.assertIn(response.status_code, [200, 400])
 
+class TenantAppTestCase(unittest.TestCase):
+    """Base class: a temporary database with one school, logged in"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self._original_path = database.DATABASE_PATH
+        database.DATABASE_PATH = os.path.join(self.temp_dir, 'test.db')
+        database.close_pool()
+        database.init_database()
+        save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 1000})
+        save_school_budget(1, '2026-2027', {'items': [{
+            'template_row_id': 1, 'id': 'pow1_row1', 'powNo': '1', 'powName': 'POW 1',
+            'subActivity': 'Activity', 'subItemDescription': 'Item 1', 'code': '221101',
+            'totalAllocation': 1200.0, 'monthlyAllocations': {}
+        }]})
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 1, 'name': 'Test School', 'username': 'test', 'is_developer': False}
+            sess['financial_year'] = '2026-2027'
+
+    def tearDown(self):
+        database.close_pool()
+        database.DATABASE_PATH = self._original_path
+        shutil.rmtree(self.temp_dir)
+
+    def login_developer(self):
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 0, 'name': 'Developer', 'username': 'dev', 'is_developer': True}
+
+
+class ConditionalGetTestCase(TenantAppTestCase):
+    """Tenant pages answer 304 Not Modified until the school's data changes"""
+
+    def test_unchanged_page_is_not_modified(self):
+        """Revalidating with the ETag skips the page until a debit is posted"""
+        first = self.client.get('/tracking')
+        self.assertEqual(first.status_code, 200)
+        self.assertIsNotNone(first.headers.get('ETag'))
+        self.assertIn('no-cache', first.headers['Cache-Control'])
+
+        etag = first.headers['ETag']
+        second = self.client.get('/tracking', headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0})
+        third = self.client.get('/tracking', headers={'If-None-Match': etag})
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers['ETag'], etag)
+
+    def test_page_etag_ignores_unrelated_data(self):
+        """The budget export does not change when a debit is posted"""
+        etag = self.client.get('/export_budget_excel').headers['ETag']
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0})
+        response = self.client.get('/export_budget_excel', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_modified_revalidation(self):
+        """If-Modified-Since is honoured once the change is in the past"""
+        database.run_write(lambda conn: conn.execute(
+            'UPDATE tenant_versions SET updated_at = updated_at - 60'))
+        app_module = sys.modules[app.import_name]
+        page_build = app_module.PAGE_BUILD
+        app_module.PAGE_BUILD = 0
+        self.addCleanup(setattr, app_module, 'PAGE_BUILD', page_build)
+        first = self.client.get('/budget')
+        last_modified = first.headers.get('Last-Modified')
+        self.assertIsNotNone(last_modified)
+        response = self.client.get('/budget', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+
+class RegisterPagesTestCase(TenantAppTestCase):
+    """The credit and debit register pages"""
+
+    def test_credits_page_shows_credited_per_item(self):
+        """The add-credit form lists what each item has been credited to date"""
+        from db_helpers import save_school_credit
+        for amount in (300.0, 45.5):
+            save_school_credit(1, '2026-2027', {'date': '2026-05-01', 'month': 'May', 'lineItems': [
+                {'itemId': 'pow1_row1', 'subItemDescription': 'Item 1', 'code': '221101', 'amount': amount}
+            ]})
+        response = self.client.get('/credits')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'K345.50', response.data)
+
+    def test_debits_register_is_paged(self):
+        """The debits page shows one page and links to the older rows"""
+        for day in range(1, 6):
+            save_school_debit(1, '2026-2027', {
+                'date': f'2026-05-0{day}', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 10.0})
+        first = self.client.get('/debits?per_page=2')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'Showing 2 of 5 debits', first.data)
+        self.assertIn(b'before=2026-05-04_', first.data)
+
+        # Each page has its own ETag
+        older = self.client.get('/debits?per_page=2&before=2026-05-04_4',
+                                headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(older.status_code, 200)
+        self.assertIn(b'after=2026-05-03_3', older.data)
+
+    def test_add_debit_requires_a_budget_item(self):
+        """A debit with no or an unknown item is rejected, not offered as an overspend"""
+        for item_id in (None, 'pow9_row9'):
+            response = self.client.post('/add_debit', json={
+                'date': '2026-05-01', 'month': 'May', 'itemId': item_id, 'amount': 10.0})
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('overspend', response.get_json())
+        self.assertEqual(get_school_debits(1, '2026-2027'), [])
+
+
+class DocumentPrintingTestCase(TenantAppTestCase):
+    """GP10s, loose minutes and receipts: viewing, printing by month and finalizing"""
+
+    def test_receipt_reads_one_debit(self):
+        """A receipt is read from the one debit and fills in its budget item"""
+        debit_id = save_school_debit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0,
+            'supplierName': 'Acme Stationers', 'description': 'Chalk'})
+        response = self.client.get(f'/receipt/debit_{debit_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Acme Stationers', response.data)
+        self.assertIn(b'221101 (Item 1)', response.data)
+        self.assertIn(b'2026-2027', response.data)
+        self.assertEqual(self.client.get('/receipt/debit_999').status_code, 404)
+
+    def test_print_month_of_receipts(self):
+        """A month of receipts prints as one bundle without writing anything"""
+        for day, supplier in ((3, 'Second Supplier'), (1, 'First Supplier')):
+            save_school_debit(1, '2026-2027', {
+                'date': f'2026-05-0{day}', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0,
+                'supplierName': supplier, 'description': 'Chalk'})
+        response = self.client.get('/print_documents?type=receipt&month=May')
+        self.assertEqual(response.status_code, 200)
+        html = response.data.decode()
+        self.assertEqual(html.count('class="document-page"'), 2)
+        self.assertLess(html.index('First Supplier'), html.index('Second Supplier'))
+        self.assertIn('#0001', html)
+        self.assertIn('#0002', html)
+        revalidated = self.client.get('/print_documents?type=receipt&month=May',
+                                      headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(self.client.get('/print_documents?type=receipt&month=June').status_code, 404)
+        self.assertEqual(self.client.get('/print_documents?type=invoice').status_code, 400)
+
+    def test_finalize_numbers_unnumbered_debits(self):
+        """Document views show DRAFT until the month is finalized"""
+        original = database.DOCUMENT_NUMBERING
+        database.DOCUMENT_NUMBERING = 'finalize'
+        try:
+            debit_id = save_school_debit(1, '2026-2027', {
+                'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0,
+                'supplierName': 'Acme', 'description': 'Chalk'})
+        finally:
+            database.DOCUMENT_NUMBERING = original
+        first = self.client.get(f'/receipt/debit_{debit_id}')
+        self.assertIn(b'#DRAFT', first.data)
+        self.assertEqual(self.client.get(f'/receipt/debit_{debit_id}',
+                                         headers={'If-None-Match': first.headers['ETag']}).status_code, 304)
+
+        response = self.client.post('/finalize_documents', json={'month': 'May'})
+        self.assertEqual(response.get_json(),
+                         {'success': True, 'numbered': {'looseMinute': 1, 'receipt': 1}})
+        self.assertIn(b'#0001', self.client.get(f'/receipt/debit_{debit_id}').data)
+
+
+class ExportTestCase(TenantAppTestCase):
+    """Budget and register downloads"""
+
+    def test_budget_export_workbook(self):
+        """The budget export streams a workbook with styled rows and SUM totals"""
+        from io import BytesIO
+        import openpyxl
+        response = self.client.get('/export_budget_excel')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Budget_Allocation_2026-2027.xlsx', response.headers['Content-Disposition'])
+        self.assertEqual(response.content_length, len(response.data))
+        ws = openpyxl.load_workbook(BytesIO(response.data))['Budget Allocation']
+        self.assertEqual(ws['A4'].value, 'BUDGET ALLOCATION')
+        self.assertIn('A4:T4', [str(r) for r in ws.merged_cells.ranges])
+        self.assertEqual(ws['A7'].value, 'POW No')
+        self.assertTrue(ws['A7'].font.b)
+        self.assertEqual([ws['D8'].value, ws['F8'].value, ws['T8'].value], ['Item 1', 1200.0, 1200.0])
+        self.assertEqual(ws['F9'].value, '=SUM(F8:F8)')
+        self.assertEqual(ws.column_dimensions['D'].width, 40)
+
+    def test_register_exports(self):
+        """Registers export as CSV and XLSX, filtered by date and item"""
+        from io import BytesIO
+        import openpyxl
+        from db_helpers import save_school_credit
+        for day in (1, 2, 3):
+            save_school_debit(1, '2026-2027', {
+                'date': f'2026-05-0{day}', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 10.0 * day,
+                'supplierName': f'Supplier {day}', 'description': 'Chalk, white'})
+        save_school_credit(1, '2026-2027', {'date': '2026-05-01', 'month': 'May', 'lineItems': [
+            {'itemId': 'pow1_row1', 'subItemDescription': 'Item 1', 'code': '221101', 'amount': 500.0},
+            {'itemId': 'pow1_row2', 'subItemDescription': 'Item 2', 'code': '221102', 'amount': 25.0}
+        ]})
+
+        response = self.client.get('/export_debits?from=2026-05-02')
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('Debits_Register_2026-2027.csv', response.headers['Content-Disposition'])
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['Date', 'Month', 'Voucher No'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['2026-05-02', '2026-05-03'])
+        self.assertIn('"Chalk, white"', lines[1])
+
+        response = self.client.get('/export_credits?format=xlsx&item=pow1_row2')
+        ws = openpyxl.load_workbook(BytesIO(response.data)).active
+        self.assertEqual([[c.value for c in row] for row in ws.iter_rows()], [
+            ['Date', 'Month', 'Code', 'Sub Item Description', 'Amount (MWK)', 'Remarks'],
+            ['2026-05-01', 'May', '221102', 'Item 2', 25.0, None]
+        ])
+        self.assertEqual(self.client.get('/export_credits?format=pdf').status_code, 400)
+
+
+class ExportCacheTestCase(TenantAppTestCase):
+    """Export files are kept on disk and sent again until the data changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = export_cache.ExportCache(os.path.join(self.temp_dir, 'exports'), max_bytes=1024 * 1024)
+        self._original_cache = export_cache._cache
+        export_cache._cache = self.cache
+
+    def tearDown(self):
+        export_cache._cache = self._original_cache
+        super().tearDown()
+
+    def _small_cache(self):
+        """A cache of its own that holds only 25 bytes"""
+        return export_cache.ExportCache(os.path.join(self.temp_dir, 'small'), max_bytes=25)
+
+    def test_store_and_find(self):
+        cache = self._small_cache()
+        self.assertIsNone(cache.get(('budget', 1)))
+        path = cache.put(('budget', 1), 'Budget.xlsx', [b'abc', b'def'])
+        self.assertEqual(os.path.basename(path), 'Budget.xlsx')
+        self.assertEqual(cache.get(('budget', 1)), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+        self.assertIsNone(cache.get(('budget', 2)))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['files'], stats['bytes']), (1, 2, 1, 6))
+
+    def test_least_recently_used_evicted(self):
+        cache = self._small_cache()
+        for n in (1, 2):
+            cache.put(('export', n), 'export.csv', [b'x' * 10])
+        # Using the first entry makes the second the least recently used
+        first = cache.get(('export', 1))
+        os.utime(first, (os.path.getmtime(first) + 5,) * 2)
+        cache.put(('export', 3), 'export.csv', [b'x' * 10])
+        self.assertIsNotNone(cache.get(('export', 1)))
+        self.assertIsNone(cache.get(('export', 2)))
+        self.assertIsNotNone(cache.get(('export', 3)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_new_entry_is_not_evicted(self):
+        """A file larger than the whole cache is still stored and returned"""
+        cache = self._small_cache()
+        cache.put(('export', 1), 'export.csv', [b'x' * 10])
+        path = cache.put(('export', 2), 'export.csv', [b'x' * 30])
+        self.assertTrue(os.path.exists(path))
+        self.assertIsNone(cache.get(('export', 1)))
+
+    def test_same_key_stored_twice(self):
+        cache = self._small_cache()
+        cache.put(('export', 1), 'export.csv', [b'one'])
+        path = cache.put(('export', 1), 'export.csv', [b'two'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'one')
+        self.assertEqual(cache.stats()['files'], 1)
+
+    def test_exports_served_from_cache(self):
+        """Repeated exports are sent from the export cache until the data changes"""
+        first = self.client.get('/export_debits?format=csv')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Debits_Register_2026-2027.csv', first.headers['Content-Disposition'])
+        second = self.client.get('/export_debits?format=csv')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual((self.cache.hits, self.cache.stores), (1, 1))
+
+        partial = self.client.get('/export_debits?format=csv', headers={'Range': 'bytes=0-3'})
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.data, first.data[:4])
+
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0})
+        third = self.client.get('/export_debits?format=csv')
+        self.assertEqual(len(third.data.decode().splitlines()), 2)
+        self.assertEqual(self.cache.stores, 2)
+
+    def test_evicted_export_is_rebuilt(self):
+        """A cached file removed before it is sent is built again"""
+        first = self.client.get('/export_debits?format=csv')
+        self.cache.get = lambda key: os.path.join(self.temp_dir, 'exports', 'evicted', 'Debits.csv')
+        second = self.client.get('/export_debits?format=csv')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+
+
+class DeleteSchoolTestCase(TenantAppTestCase):
+    """Developers delete a school with everything stored for it"""
+
+    def setUp(self):
+        super().setUp()
+        with database.get_db() as conn:
+            conn.execute("INSERT INTO schools (school_name, username, password_hash) VALUES ('Test School', 'test', 'x')")
+        save_school_credit(1, '2026-2027', {'date': '2026-05-01', 'month': 'May', 'lineItems': [
+            {'itemId': 'pow1_row1', 'amount': 500.0}]})
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-05-02', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 40.0})
+        self.login_developer()
+
+    def test_delete_removes_derived_rows(self):
+        """Balances, monthly totals, number sequences and versions go too"""
+        response = self.client.post('/dev/delete-school/1')
+        self.assertTrue(response.get_json()['success'])
+        with database.get_read_db() as conn:
+            for table in ('credit_line_items', 'budget_item_balances', 'monthly_summary',
+                          'document_sequences', 'tenant_versions'):
+                count = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE school_id = 1').fetchone()[0]
+                self.assertEqual(count, 0, table)
+
+
+class DistrictExportTestCase(TenantAppTestCase):
+    """Developers export every school's budget versus actual in one workbook"""
+
+    def setUp(self):
+        import district_export
+        super().setUp()
+        self._original_dir = district_export.DISTRICT_EXPORT_DIR
+        self._original_workers = district_export.DISTRICT_EXPORT_WORKERS
+        district_export.DISTRICT_EXPORT_DIR = os.path.join(self.temp_dir, 'exports')
+        district_export.DISTRICT_EXPORT_WORKERS = 2
+        with database.get_db() as conn:
+            for name in ('Zomba CDSS', 'Bwaila Secondary'):
+                conn.execute('''
+                    INSERT INTO schools (school_name, username, password_hash) VALUES (?, ?, 'x')
+                ''', (name, name.lower()))
+        # School 1 has the base budget of 1200
+        save_school_budget(2, '2026-2027', {'items': [{
+            'template_row_id': 1, 'id': 'pow1_row1', 'powNo': '1', 'powName': 'POW 1',
+            'subActivity': 'Activity', 'subItemDescription': 'Item 1', 'code': '221101',
+            'totalAllocation': 800.0, 'monthlyAllocations': {}
+        }]})
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 200.0})
+        self.login_developer()
+
+    def tearDown(self):
+        import district_export
+        district_export.DISTRICT_EXPORT_DIR = self._original_dir
+        district_export.DISTRICT_EXPORT_WORKERS = self._original_workers
+        super().tearDown()
+
+    def test_district_workbook(self):
+        """One summary sheet plus a sheet per school, built by a background job"""
+        from io import BytesIO
+        import openpyxl
+        started = self.client.post('/dev/district-export', json={'financialYear': '2026-2027'}).get_json()
+        self.assertTrue(started['success'])
+        self.assertEqual(started['total'], 2)
+
+        deadline = time.time() + 60
+        while True:
+            status = self.client.get(f"/dev/district-export/{started['job']}").get_json()
+            if status['state'] != 'running' or time.time() > deadline:
+                break
+            time.sleep(0.1)
+        self.assertEqual((status['state'], status['done'], status['total']), ('done', 2, 2))
+
+        response = self.client.get(f"/dev/district-export/{started['job']}/download")
+        self.assertEqual(response.status_code, 200)
+        wb = openpyxl.load_workbook(BytesIO(response.data))
+        self.assertEqual(wb.sheetnames, ['District Summary', 'Bwaila Secondary', 'Zomba CDSS'])
+        summary = [[c.value for c in row] for row in wb['District Summary'].iter_rows(min_row=4)]
+        self.assertEqual(summary, [
+            ['Bwaila Secondary', 800.0, 0.0, 0.0, 800.0, 0.0],
+            ['Zomba CDSS', 1200.0, 0.0, 200.0, 1000.0, -200.0],
+            ['DISTRICT TOTALS', 2000.0, 0.0, 200.0, 1800.0, -200.0]
+        ])
+        self.assertEqual(wb['Zomba CDSS']['G4'].value, 200.0)
+        self.assertEqual(self.client.get('/dev/district-export/not-a-job').status_code, 404)
+
+
+class BudgetImportTestCase(TenantAppTestCase):
+    """Budgets are imported from files in the budget export layout"""
+
+    def setUp(self):
+        from app import generate_budget_structure
+        super().setUp()
+        # Imports match rows of the full budget template
+        save_school_budget(1, '2026-2027', {'items': generate_budget_structure()})
+
+    def _upload(self, data, filename):
+        from io import BytesIO
+        return self.client.post('/import_budget', data={'file': (BytesIO(data), filename)},
+                                content_type='multipart/form-data')
+
+    def _export_rows(self):
+        from io import BytesIO
+        import openpyxl
+        ws = openpyxl.load_workbook(BytesIO(self.client.get('/export_budget_excel').data)).active
+        return [[c.value for c in row] for row in ws.iter_rows()]
+
+    def test_exported_workbook_round_trips(self):
+        """An edited export is imported into the matching template rows"""
+        from io import BytesIO
+        import openpyxl
+        from db_helpers import get_school_budget
+        wb = openpyxl.load_workbook(BytesIO(self.client.get('/export_budget_excel').data))
+        ws = wb.active
+        # Row 8 is template row 1; the two POW 10 rows share a code
+        ws['F8'], ws['G8'], ws['H8'] = 1500, 1000, 500
+        pow10 = [row for row in range(8, 50) if ws.cell(row, 1).value == 10]
+        ws.cell(pow10[1], 6).value = 120
+        ws.cell(pow10[1], 18).value = '120'
+        output = BytesIO()
+        wb.save(output)
+
+        response = self._upload(output.getvalue(), 'budget.xlsx')
+        self.assertEqual(response.get_json(), {'success': True, 'imported': 42})
+        items = {item['template_row_id']: item for item in get_school_budget(1, '2026-2027')['items']}
+        self.assertEqual(items[1]['totalAllocation'], 1500.0)
+        self.assertEqual([items[1]['monthlyAllocations'][m] for m in ('April', 'May', 'June')], [1000.0, 500.0, 0])
+        self.assertEqual((items[31]['totalAllocation'], items[32]['totalAllocation']), (0, 120.0))
+        self.assertEqual(items[32]['monthlyAllocations']['March'], 120.0)
+
+    def test_every_invalid_row_is_reported(self):
+        """Validation reports every bad row and saves nothing"""
+        import csv
+        from db_helpers import get_school_budget
+        rows = self._export_rows()
+        rows[7][5], rows[7][6] = 1000, 999.5
+        rows[8][4] = '9999999999'
+        rows[9][7] = 'ten'
+        rows[10][5], rows[10][17] = 50, 50
+        rows.append(list(rows[10]))
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+
+        response = self._upload(buffer.getvalue().encode(), 'budget.csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['errors'], [
+            'Row 8: months add up to 999.50 but the annual allocation is 1,000.00',
+            'Row 9: POW 1 code 9999999999 is not in the budget template',
+            'Row 10: May must be a number of 0 or more',
+            f"Row {len(rows)}: POW {rows[10][0]} code {rows[10][4]} ({rows[10][3]}) appears more than once"
+        ])
+        self.assertEqual(get_school_budget(1, '2026-2027')['items'][0]['totalAllocation'], 0)
+
+        self.assertEqual(self._upload(b'not a budget', 'budget.pdf').status_code, 400)
+        self.assertIn('header', self._upload(b'a,b\n1,2\n', 'budget.csv').get_json()['errors'][0])
+
+
 if __name__ == '__main__':
     unittest.main()
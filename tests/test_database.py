@@ -0,0 +1,888 @@
+#!/usr/bin/env python3
+"""
+Test Suite for the database layer (connection pool and helpers)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import database
+import db_session
+import tenant_cache
+from ledger import LedgerSnapshot, build_ledger_snapshot
+from db_helpers import (
+    get_school_settings, save_school_settings,
+    get_school_budget, save_school_budget,
+    get_school_credits, get_school_credited_by_item, save_school_credit, delete_school_credit,
+    get_school_ledger, get_school_item_balance, get_school_monthly_summary, get_school_grand_totals,
+    get_school_debits, get_school_credits_page, get_school_debits_page,
+    get_school_debit, get_school_budget_item, get_school_debits_for_documents,
+    iter_school_debits_export,
+    save_school_debit, delete_school_debit,
+    get_next_document_number, reserve_document_numbers, assign_debit_document_numbers
+)
+
+
+def make_budget_items():
+    """Three budget rows across two POWs"""
+    items = []
+    for row_id, pow_no in [(1, '1'), (2, '1'), (3, '2')]:
+        items.append({
+            'template_row_id': row_id,
+            'id': f'pow{pow_no}_row{row_id}',
+            'powNo': pow_no,
+            'powName': f'POW {pow_no}',
+            'subActivity': 'Activity',
+            'subItemDescription': f'Item {row_id}',
+            'code': f'22110{row_id}',
+            'totalAllocation': 1200.0 * row_id,
+            'monthlyAllocations': {month: 100.0 * row_id for month in database.MONTHS}
+        })
+    return items
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Base class that points the database layer at a temporary file"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self._original_path = database.DATABASE_PATH
+        database.DATABASE_PATH = os.path.join(self.temp_dir, 'test.db')
+        database.close_pool()
+        database.init_database()
+
+    def tearDown(self):
+        database.close_pool()
+        database.DATABASE_PATH = self._original_path
+        shutil.rmtree(self.temp_dir)
+
+
+class ConnectionPoolTestCase(DatabaseTestCase):
+
+    def test_connections_are_reused(self):
+        """Sequential get_db calls reuse one warm connection"""
+        with database.get_db() as conn:
+            first = id(conn)
+        with database.get_db() as conn:
+            second = id(conn)
+        self.assertEqual(first, second)
+        stats = database.get_pool_stats()['writer']
+        self.assertEqual(stats['connects'], 1)
+        self.assertGreaterEqual(stats['checkouts'], 2)
+
+    def test_pragmas_applied(self):
+        """Pooled connections are configured for WAL and busy timeout"""
+        with database.get_db() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 10000)
+
+    def test_rollback_on_error(self):
+        """A failed block is rolled back and the connection returned"""
+        with self.assertRaises(ValueError):
+            with database.get_db() as conn:
+                conn.execute("INSERT INTO schools (school_name, username, password_hash) VALUES ('A', 'a', 'x')")
+                raise ValueError('boom')
+        with database.get_db() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM schools').fetchone()[0]
+        self.assertEqual(count, 0)
+        self.assertEqual(database.get_pool_stats()['writer']['in_use'], 0)
+
+    def test_read_connections_are_read_only(self):
+        """Reader connections refuse writes and never begin a transaction"""
+        with database.get_read_db() as conn:
+            self.assertEqual(conn.execute('PRAGMA query_only').fetchone()[0], 1)
+            with self.assertRaises(Exception):
+                conn.execute("INSERT INTO schools (school_name, username, password_hash) VALUES ('A', 'a', 'x')")
+            self.assertFalse(conn.in_transaction)
+        stats = database.get_pool_stats()
+        self.assertEqual(stats['reader']['checkouts'], 1)
+        self.assertTrue(stats['reader']['readonly'])
+
+    def test_pool_waits_when_exhausted(self):
+        """Threads wait for a free connection instead of opening more"""
+        pool = database.get_pool()
+        held = [pool.acquire() for _ in range(pool.max_size)]
+        results = []
+
+        def worker():
+            with database.get_db() as conn:
+                results.append(conn.execute('SELECT 1').fetchone()[0])
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(results, [])
+        pool.release(held.pop())
+        thread.join(5)
+        for conn in held:
+            pool.release(conn)
+
+        self.assertEqual(results, [1])
+        stats = pool.stats()
+        self.assertEqual(stats['size'], pool.max_size)
+        self.assertGreaterEqual(stats['waits'], 1)
+
+
+class WriteQueueTestCase(DatabaseTestCase):
+
+    def _insert_school(self, name):
+        def _insert(conn):
+            cursor = conn.execute(
+                'INSERT INTO schools (school_name, username, password_hash) VALUES (?, ?, ?)',
+                (name, name, 'x'))
+            return cursor.lastrowid
+        return _insert
+
+    def test_group_commit_isolates_failures(self):
+        """Queued writes commit together; a failing job only loses itself"""
+        writer = database.WriteQueue()
+        self.addCleanup(writer.close)
+        futures = [writer.submit(self._insert_school(f'school{i}')) for i in range(5)]
+        failing = writer.submit(self._insert_school('school0'))
+        ids = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(len(set(ids)), 5)
+        with self.assertRaises(Exception):
+            failing.result(timeout=5)
+        with database.get_read_db() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM schools').fetchone()[0], 5)
+        stats = writer.stats()
+        self.assertEqual(stats['jobs'], 6)
+        self.assertEqual(stats['failed'], 1)
+
+    def test_close_applies_queued_jobs(self):
+        """close() stops the thread after the queued writes; stats include a write once it resolves"""
+        writer = database.WriteQueue()
+        jobs_seen = []
+        futures = [writer.submit(self._insert_school(f'school{i}')) for i in range(3)]
+        futures[0].add_done_callback(lambda future: jobs_seen.append(writer.stats()['jobs']))
+        writer.close(timeout=5)
+
+        self.assertFalse(writer._thread.is_alive())
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertGreaterEqual(jobs_seen[0], 1)
+
+    def test_close_pool_stops_the_writer_thread(self):
+        writer = database.get_write_queue()
+        database.close_pool()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertIsNot(database.get_write_queue(), writer)
+
+    def test_run_write_uses_queue_when_enabled(self):
+        """log_action goes through the writer thread and returns the row id"""
+        original = database.DB_WRITE_QUEUE
+        database.DB_WRITE_QUEUE = True
+        try:
+            row_id = database.log_action('SCHOOL', '1', 'LOGIN', 1)
+        finally:
+            database.DB_WRITE_QUEUE = original
+        self.assertEqual(row_id, 1)
+        self.assertGreaterEqual(database.get_write_queue().stats()['jobs'], 1)
+
+
+class BudgetStorageTestCase(DatabaseTestCase):
+
+    def test_monthly_allocations_round_trip(self):
+        """Monthly allocations are stored in typed columns and read back"""
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+        budget = get_school_budget(1, '2026-2027')
+        self.assertEqual(len(budget['items']), 3)
+        self.assertEqual(budget['items'][1]['monthlyAllocations']['March'], 200.0)
+        self.assertEqual(budget['items'][1]['monthlyTotal'], 2400.0)
+        with database.get_read_db() as conn:
+            row = conn.execute('SELECT alloc_march, monthly_allocations FROM budget_items WHERE template_row_id = 2').fetchone()
+        self.assertEqual(row['alloc_march'], 200.0)
+        self.assertIsNone(row['monthly_allocations'])
+
+    def test_legacy_json_allocations_are_migrated(self):
+        """upgrade_schema moves JSON allocations into the month columns"""
+        with database.get_db() as conn:
+            conn.execute('''
+                INSERT INTO budget_items (school_id, financial_year, template_row_id, item_key, monthly_allocations)
+                VALUES (1, '2026-2027', 1, 'pow1_row1', '{"April": 50, "March": "25"}')
+            ''')
+        database.upgrade_schema()
+        budget = get_school_budget(1, '2026-2027')
+        self.assertEqual(budget['items'][0]['monthlyAllocations']['April'], 50.0)
+        self.assertEqual(budget['items'][0]['monthlyAllocations']['March'], 25.0)
+        self.assertEqual(budget['items'][0]['monthlyTotal'], 75.0)
+
+
+class CreditLineItemsTestCase(DatabaseTestCase):
+
+    def _credit(self, *amounts):
+        return {
+            'date': '2026-05-01',
+            'month': 'May',
+            'remarks': 'Test',
+            'lineItems': [
+                {'itemId': item_id, 'subItemDescription': 'Item', 'code': '2211', 'amount': amount}
+                for item_id, amount in amounts
+            ]
+        }
+
+    def test_line_items_stored_as_rows(self):
+        """Credits keep their line items in order and sum per item in SQL"""
+        credit_id = save_school_credit(1, '2026-2027', self._credit(('pow1_row1', 100), ('pow1_row2', 50)))
+        save_school_credit(1, '2026-2027', self._credit(('pow1_row1', 25)))
+        save_school_credit(2, '2026-2027', self._credit(('pow1_row1', 999)))
+
+        credits = get_school_credits(1, '2026-2027')
+        first = next(c for c in credits if c['id'] == f'credit_{credit_id}')
+        self.assertEqual([li['itemId'] for li in first['lineItems']], ['pow1_row1', 'pow1_row2'])
+        self.assertEqual(get_school_credited_by_item(1, '2026-2027'), {'pow1_row1': 125.0, 'pow1_row2': 50.0})
+
+    def test_deleting_credit_removes_line_items(self):
+        """Line items are removed together with their credit"""
+        credit_id = save_school_credit(1, '2026-2027', self._credit(('pow1_row1', 100)))
+        delete_school_credit(1, f'credit_{credit_id}')
+        self.assertEqual(get_school_credited_by_item(1, '2026-2027'), {})
+
+    def test_legacy_json_line_items_are_migrated(self):
+        """upgrade_schema moves credits.line_items JSON into rows"""
+        with database.get_db() as conn:
+            conn.execute('''
+                INSERT INTO credits (school_id, financial_year, date_received, month, line_items)
+                VALUES (1, '2026-2027', '2026-05-01', 'May', '[{"itemId": "pow1_row1", "amount": 40}]')
+            ''')
+        database.upgrade_schema()
+        database.upgrade_schema()
+        self.assertEqual(get_school_credited_by_item(1, '2026-2027'), {'pow1_row1': 40.0})
+        self.assertEqual(get_school_credits(1, '2026-2027')[0]['lineItems'][0]['amount'], 40.0)
+
+
+class LedgerTestCase(DatabaseTestCase):
+
+    def test_ledger_aggregates_per_item(self):
+        """One query yields budgeted, credited, spent and balance per item"""
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+        save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 500}, {'itemId': 'pow1_row2', 'amount': 300}]
+        })
+        for amount in (100, 50):
+            save_school_debit(1, '2026-2027', {
+                'documentNumber': '0001', 'date': '2026-05-02', 'month': 'May',
+                'itemId': 'pow1_row1', 'amount': amount
+            })
+        save_school_debit(2, '2026-2027', {
+            'documentNumber': '0001', 'date': '2026-05-02', 'month': 'May',
+            'itemId': 'pow1_row1', 'amount': 999
+        })
+
+        ledger = {item['id']: item for item in get_school_ledger(1, '2026-2027')}
+        self.assertEqual(len(ledger), 3)
+        self.assertEqual(ledger['pow1_row1']['budgeted'], 1200.0)
+        self.assertEqual(ledger['pow1_row1']['credited'], 500.0)
+        self.assertEqual(ledger['pow1_row1']['spent'], 150.0)
+        self.assertEqual(ledger['pow1_row1']['balance'], 350.0)
+        self.assertEqual(ledger['pow2_row3']['balance'], 0)
+
+
+class RegisterPageTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Two debits share each date, so pages must break ties on id
+        for day in range(1, 6):
+            for amount in (10, 20):
+                save_school_debit(1, '2026-2027', {
+                    'documentNumber': '0001', 'date': f'2026-05-0{day}', 'month': 'May',
+                    'itemId': 'pow1_row1', 'amount': amount
+                })
+        save_school_debit(2, '2026-2027', {
+            'documentNumber': '0001', 'date': '2026-05-09', 'month': 'May',
+            'itemId': 'pow1_row1', 'amount': 999
+        })
+        self.register = get_school_debits(1, '2026-2027')
+
+    def test_pages_walk_the_register_in_order(self):
+        """Following the older cursors visits every row once, newest first"""
+        seen = []
+        page = get_school_debits_page(1, '2026-2027', 3)
+        self.assertIsNone(page['newer'])
+        while True:
+            seen.extend(page['rows'])
+            if page['older'] is None:
+                break
+            page = get_school_debits_page(1, '2026-2027', 3, page['older'])
+        self.assertEqual([d['id'] for d in seen], [d['id'] for d in self.register])
+
+    def test_newer_cursor_returns_previous_page(self):
+        """Paging back from the second page gives the first page again"""
+        first = get_school_debits_page(1, '2026-2027', 4)
+        second = get_school_debits_page(1, '2026-2027', 4, first['older'])
+        self.assertEqual([d['id'] for d in second['rows']],
+                         [d['id'] for d in self.register[4:8]])
+        back = get_school_debits_page(1, '2026-2027', 4, None, second['newer'])
+        self.assertEqual(back['rows'], first['rows'])
+        self.assertIsNone(back['newer'])
+        self.assertEqual(back['older'], first['older'])
+
+    def test_export_rows_read_in_batches(self):
+        """The export reads the whole register, oldest first, then frees its connection"""
+        rows = iter_school_debits_export(1, '2026-2027', None, '2026-05-02', None, 3)
+        self.assertEqual(database.get_pool_stats()['reader']['in_use'], 0)
+        self.assertEqual(next(rows)[:2], ['2026-05-01', 'May'])
+        self.assertEqual(database.get_pool_stats()['reader']['in_use'], 1)
+        self.assertEqual([row[8] for row in rows], [20, 10, 20])
+        self.assertEqual(database.get_pool_stats()['reader']['in_use'], 0)
+
+    def test_credit_pages_carry_line_items(self):
+        """Credit pages hold the same rows as the full register"""
+        for day in (1, 2, 3):
+            save_school_credit(1, '2026-2027', {
+                'date': f'2026-05-0{day}', 'month': 'May',
+                'lineItems': [{'itemId': 'pow1_row1', 'amount': 100 * day}]
+            })
+        page = get_school_credits_page(1, '2026-2027', 2)
+        self.assertEqual(page['rows'], get_school_credits(1, '2026-2027')[:2])
+        self.assertEqual(page['older'][0], '2026-05-02')
+
+
+class ItemBalancesTestCase(DatabaseTestCase):
+
+    def _debit(self, amount, item_id='pow1_row1'):
+        return save_school_debit(1, '2026-2027', {
+            'documentNumber': '0001', 'date': '2026-05-02', 'month': 'May',
+            'itemId': item_id, 'amount': amount
+        })
+
+    def test_triggers_maintain_balances(self):
+        """Inserts, updates and deletes keep budget_item_balances current"""
+        credit_id = save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 500}]
+        })
+        debit_id = self._debit(100)
+        self._debit(40)
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row1'),
+                         {'credited': 500.0, 'spent': 140.0, 'balance': 360.0})
+
+        with database.get_db() as conn:
+            conn.execute("UPDATE debits SET amount = 60, item_id = 'pow1_row2' WHERE id = ?", (debit_id,))
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row1')['spent'], 40.0)
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row2')['spent'], 60.0)
+
+        delete_school_debit(1, f'debit_{debit_id}')
+        delete_school_credit(1, f'credit_{credit_id}')
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row1'),
+                         {'credited': 0.0, 'spent': 40.0, 'balance': -40.0})
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row2')['spent'], 0.0)
+
+    def test_lines_without_item_are_skipped(self):
+        """Updating a credit line that has no item writes no balance row"""
+        save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May', 'lineItems': [{'amount': 500}]
+        })
+        with database.get_db() as conn:
+            conn.execute('UPDATE credit_line_items SET amount = 300')
+            conn.execute("UPDATE credit_line_items SET item_id = 'pow1_row1'")
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row1')['credited'], 300.0)
+        with database.get_db() as conn:
+            conn.execute('UPDATE credit_line_items SET item_id = NULL')
+            conn.execute('UPDATE credit_line_items SET amount = 200')
+            rows = conn.execute('SELECT item_key, credited FROM budget_item_balances').fetchall()
+        self.assertEqual([tuple(row) for row in rows], [('pow1_row1', 0.0)])
+
+    def test_missing_item_has_zero_balance(self):
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow9_row9'),
+                         {'credited': 0.0, 'spent': 0.0, 'balance': 0.0})
+
+    def test_rebuild_repairs_drift(self):
+        """verify reports drift and rebuild recomputes from the source tables"""
+        self._debit(100)
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE budget_item_balances SET spent = 5')
+            self.assertEqual(len(database.verify_item_balances(cursor)), 1)
+            database.rebuild_item_balances(cursor)
+            self.assertEqual(database.verify_item_balances(cursor), [])
+        self.assertEqual(get_school_item_balance(1, '2026-2027', 'pow1_row1')['spent'], 100.0)
+
+
+class MonthlySummaryTestCase(DatabaseTestCase):
+
+    def test_triggers_maintain_monthly_totals(self):
+        may_credit = save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 500}, {'itemId': 'pow1_row2', 'amount': 250}]
+        })
+        save_school_credit(1, '2026-2027', {
+            'date': '2027-03-01', 'month': 'March',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 100}]
+        })
+        debit_id = save_school_debit(1, '2026-2027', {
+            'date': '2026-05-02', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 80
+        })
+        monthly = get_school_monthly_summary(1, '2026-2027')
+        self.assertEqual(monthly['credited'][1], 750.0)
+        self.assertEqual(monthly['credited'][11], 100.0)
+        self.assertEqual(monthly['spent'][1], 80.0)
+        self.assertEqual(monthly['credited'][0], 0)
+        self.assertEqual(monthly['totalSpent'], 80.0)
+
+        delete_school_credit(1, f'credit_{may_credit}')
+        delete_school_debit(1, f'debit_{debit_id}')
+        monthly = get_school_monthly_summary(1, '2026-2027')
+        self.assertEqual(monthly['credited'][1], 0.0)
+        self.assertEqual(monthly['spent'][1], 0.0)
+        self.assertEqual(monthly['totalCredited'], 100.0)
+        with database.get_db() as conn:
+            self.assertEqual(database.verify_monthly_summary(conn.cursor()), [])
+
+    def test_rebuild_matches_triggers(self):
+        save_school_credit(1, '2026-2027', {
+            'date': '2026-06-01', 'month': 'June', 'lineItems': [{'itemId': 'pow1_row1', 'amount': 40}]
+        })
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM monthly_summary')
+            self.assertEqual(len(database.verify_monthly_summary(cursor)), 1)
+            self.assertEqual(database.rebuild_monthly_summary(cursor), 1)
+            self.assertEqual(database.verify_monthly_summary(cursor), [])
+
+
+class LedgerSnapshotTestCase(DatabaseTestCase):
+
+    def test_snapshot_totals_agree(self):
+        """Item, POW, month and grand totals are built from the same data"""
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+        save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 500}, {'itemId': 'pow2_row3', 'amount': 200}]
+        })
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-06-02', 'month': 'June', 'itemId': 'pow1_row1', 'amount': 120
+        })
+
+        snapshot = build_ledger_snapshot(1, '2026-2027')
+        self.assertEqual(snapshot.item('pow1_row1')['balance'], 380.0)
+        self.assertEqual(snapshot.item('missing')['balance'], 0.0)
+        self.assertEqual([str(p['powNo']) for p in snapshot.pows], ['1', '2'])
+        self.assertEqual(snapshot.pows[0]['budgeted'], 3600.0)
+        self.assertEqual(snapshot.pows[0]['balance'], 380.0)
+        self.assertEqual(snapshot.monthly_credited[1], 700.0)
+        self.assertEqual(snapshot.monthly_spent[2], 120.0)
+        self.assertEqual(snapshot.totals, {
+            'budgeted': 7200.0, 'credited': 700.0, 'spent': 120.0, 'balance': 580.0
+        })
+        self.assertEqual(snapshot.counts, {'credits': 1, 'debits': 1})
+        self.assertEqual(snapshot.spending[0]['balance'], 1080.0)
+        self.assertEqual(sum(p['credited'] for p in snapshot.pows), snapshot.totals['credited'])
+
+    def test_grand_totals_include_unallocated_lines(self):
+        """Credit lines with no budget item count in the grand totals"""
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+        get_school_grand_totals(1, '2026-2027')
+        save_school_credit(1, '2026-2027', {
+            'date': '2026-05-01', 'month': 'May',
+            'lineItems': [{'itemId': 'pow1_row1', 'amount': 500}, {'itemId': None, 'amount': 75}]
+        })
+
+        totals = get_school_grand_totals(1, '2026-2027')
+        self.assertEqual(totals['credited'], 575.0)
+        self.assertEqual(build_ledger_snapshot(1, '2026-2027').item('pow1_row1')['credited'], 500.0)
+
+    def test_empty_snapshot(self):
+        snapshot = LedgerSnapshot.empty('2026-2027')
+        self.assertEqual(snapshot.totals['balance'], 0.0)
+        self.assertEqual(snapshot.monthly_spent, [0] * 12)
+
+
+class SingleDebitLookupTestCase(DatabaseTestCase):
+
+    def test_debit_is_scoped_to_school_and_year(self):
+        """A debit is only found for its own school and financial year"""
+        debit_id = save_school_debit(1, '2026-2027', {
+            'documentNumber': '0001', 'date': '2026-05-02', 'month': 'May',
+            'itemId': 'pow1_row1', 'amount': 75, 'supplierName': 'Supplier'
+        })
+        debit = get_school_debit(1, '2026-2027', f'debit_{debit_id}')
+        self.assertEqual(debit, get_school_debits(1, '2026-2027')[0])
+        self.assertIsNone(get_school_debit(2, '2026-2027', f'debit_{debit_id}'))
+        self.assertIsNone(get_school_debit(1, '2025-2026', f'debit_{debit_id}'))
+        self.assertIsNone(get_school_debit(1, '2026-2027', 'debit_999'))
+        self.assertIsNone(get_school_debit(1, '2026-2027', 'not-a-debit'))
+
+    def test_budget_item_lookup(self):
+        """One budget item is read by its key"""
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+        item = get_school_budget_item(1, '2026-2027', 'pow1_row2')
+        self.assertEqual(item['code'], '221102')
+        self.assertEqual(item['powName'], 'POW 1')
+        self.assertEqual(item['totalAllocation'], 2400.0)
+        self.assertIsNone(get_school_budget_item(2, '2026-2027', 'pow1_row2'))
+
+
+class DocumentSequenceTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Loose minute and receipt numbers are left to the finalize step
+        self._original_numbering = database.DOCUMENT_NUMBERING
+        database.DOCUMENT_NUMBERING = 'finalize'
+
+    def tearDown(self):
+        database.DOCUMENT_NUMBERING = self._original_numbering
+        super().tearDown()
+
+    def _debit(self, **fields):
+        debit = {'date': '2026-05-02', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 10}
+        debit.update(fields)
+        return save_school_debit(1, '2026-2027', debit)
+
+    def test_sequence_seeded_from_existing_debits(self):
+        self._debit(documentNumber='0007')
+        self.assertEqual(get_next_document_number(1, '2026-2027', 'gp10'), '0008')
+        self.assertEqual(get_next_document_number(1, '2026-2027', 'receipt'), '0001')
+        self.assertEqual(get_next_document_number(2, '2026-2027', 'gp10'), '0001')
+
+    def test_debit_gets_number_on_save(self):
+        debit = {'date': '2026-05-02', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 10}
+        save_school_debit(1, '2026-2027', debit)
+        self.assertEqual(debit['documentNumber'], '0001')
+        self.assertEqual(get_school_debits(1, '2026-2027')[0]['documentNumber'], '0001')
+
+    def test_reserve_block(self):
+        self.assertEqual(reserve_document_numbers(1, '2026-2027', 'looseMinute', 3),
+                         ['0001', '0002', '0003'])
+        self.assertEqual(get_next_document_number(1, '2026-2027', 'looseMinute'), '0004')
+
+    def test_concurrent_allocations_are_unique(self):
+        numbers = []
+        def worker():
+            for _ in range(10):
+                numbers.append(get_next_document_number(1, '2026-2027', 'gp10'))
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(numbers), [f"{n:04d}" for n in range(1, 41)])
+
+    def test_batch_assign_numbers_in_register_order(self):
+        late = f"debit_{self._debit(date='2026-05-20')}"
+        numbered = f"debit_{self._debit(date='2026-05-10', receiptNumber='0005')}"
+        early = f"debit_{self._debit(date='2026-05-01')}"
+        assigned = assign_debit_document_numbers(1, '2026-2027', [late, numbered, early])
+        self.assertEqual(assigned['receipt'], {early: '0001', late: '0002'})
+        self.assertEqual(assigned['looseMinute'], {early: '0001', numbered: '0002', late: '0003'})
+        self.assertEqual(assign_debit_document_numbers(1, '2026-2027', [late, early]),
+                         {'looseMinute': {}, 'receipt': {}})
+        self.assertEqual(assign_debit_document_numbers(2, '2026-2027', [late], ('receipt',)),
+                         {'receipt': {}})
+
+    def test_overlapping_finalize_numbers_once(self):
+        """A finalize started while another is numbering waits for it"""
+        import db_helpers
+        debit_ids = [f"debit_{self._debit(date=f'2026-05-0{day}')}" for day in (1, 2)]
+        first_numbering = threading.Event()
+        allocate = db_helpers.allocate_document_numbers
+        def slow_allocate(cursor, *args):
+            # Hold the first finalize between its SELECT and its UPDATE
+            # while the second one starts
+            if not first_numbering.is_set():
+                first_numbering.set()
+                time.sleep(0.3)
+            return allocate(cursor, *args)
+
+        results = {}
+        def finalize(name):
+            results[name] = assign_debit_document_numbers(1, '2026-2027', debit_ids, ('looseMinute',))
+        db_helpers.allocate_document_numbers = slow_allocate
+        try:
+            first = threading.Thread(target=finalize, args=('first',))
+            first.start()
+            self.assertTrue(first_numbering.wait(5))
+            second = threading.Thread(target=finalize, args=('second',))
+            second.start()
+            first.join()
+            second.join()
+        finally:
+            db_helpers.allocate_document_numbers = allocate
+
+        self.assertEqual(results['first']['looseMinute'], {debit_ids[0]: '0001', debit_ids[1]: '0002'})
+        self.assertEqual(results['second'], {'looseMinute': {}})
+        self.assertEqual(sorted(d['looseMinuteNumber'] for d in get_school_debits(1, '2026-2027')),
+                         ['0001', '0002'])
+
+    def test_numbers_allocated_on_save(self):
+        database.DOCUMENT_NUMBERING = 'save'
+        debit = {'date': '2026-05-02', 'month': 'May', 'itemId': 'pow1_row1', 'amount': 10}
+        save_school_debit(1, '2026-2027', debit)
+        saved = get_school_debits(1, '2026-2027')[0]
+        self.assertEqual((saved['looseMinuteNumber'], saved['receiptNumber']), ('0001', '0001'))
+        self.assertEqual(debit['receiptNumber'], '0001')
+
+    def test_upgrade_numbers_unnumbered_debits(self):
+        """Debits saved without numbers are numbered by the schema upgrade"""
+        late = self._debit(date='2026-05-20')
+        early = self._debit(date='2026-05-01', receiptNumber='0003')
+        database.upgrade_schema()
+        self.assertEqual([d['receiptNumber'] for d in get_school_debits(1, '2026-2027')], ['', '0003'])
+        database.DOCUMENT_NUMBERING = 'save'
+        database.upgrade_schema()
+        numbers = {d['id']: (d['looseMinuteNumber'], d['receiptNumber']) for d in get_school_debits(1, '2026-2027')}
+        self.assertEqual(numbers, {f'debit_{early}': ('0001', '0003'), f'debit_{late}': ('0002', '0004')})
+
+    def test_debits_for_documents_filters(self):
+        first = f"debit_{self._debit(date='2026-05-01')}"
+        second = f"debit_{self._debit(date='2026-05-15')}"
+        june = f"debit_{self._debit(date='2026-06-03', month='June')}"
+        ids = lambda debits: [debit['id'] for debit in debits]
+        self.assertEqual(ids(get_school_debits_for_documents(1, '2026-2027', 'May')), [first, second])
+        self.assertEqual(ids(get_school_debits_for_documents(1, '2026-2027', None, '2026-05-10', '2026-06-03')),
+                         [second, june])
+        self.assertEqual(ids(get_school_debits_for_documents(1, '2026-2027', None, None, None, [june, first])),
+                         [first, june])
+        self.assertEqual(get_school_debits_for_documents(2, '2026-2027', 'May'), [])
+
+
+class RequestSessionTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = Flask(__name__)
+        db_session.init_app(self.app)
+        save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 1000})
+
+    def test_reads_are_memoized_per_request(self):
+        """Repeated identical reads hit the database once per request"""
+        with self.app.test_request_context('/'):
+            before = database.get_pool_stats()['reader']['checkouts']
+            first = get_school_settings(1, '2026-2027')
+            first['total_grant'] = -1
+            second = get_school_settings(1, '2026-2027')
+            after = database.get_pool_stats()['reader']['checkouts']
+        self.assertEqual(after - before, 1)
+        self.assertEqual(second['total_grant'], 1000)
+
+    def test_request_reads_share_one_snapshot(self):
+        """Writes from other connections are not visible mid-request"""
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+            get_school_settings(1, '2025-2026')
+            with database.get_db() as conn:
+                conn.execute("UPDATE school_settings SET total_grant = 5 WHERE school_id = 1")
+            db_session.get_session().memo.clear()
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 1000)
+        self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 5)
+
+    def test_writes_refresh_the_session(self):
+        """A write inside the request is visible to later reads"""
+        with self.app.test_request_context('/'):
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 1000)
+            save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 2500})
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 2500)
+        stats = database.get_pool_stats()
+        self.assertEqual(stats['reader']['in_use'], 0)
+        self.assertEqual(stats['writer']['in_use'], 0)
+
+
+
+class TenantCacheTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = Flask(__name__)
+        db_session.init_app(self.app)
+        self._original_cache = tenant_cache._cache
+        tenant_cache._cache = tenant_cache.TenantCache(max_tenants=2)
+        save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 1000})
+        save_school_budget(1, '2026-2027', {'items': make_budget_items()})
+
+    def tearDown(self):
+        tenant_cache._cache = self._original_cache
+        super().tearDown()
+
+    def test_reads_are_cached_across_requests(self):
+        """A second request reads the school's settings from the cache"""
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+        with self.app.test_request_context('/'):
+            settings = get_school_settings(1, '2026-2027')
+        self.assertEqual(settings['total_grant'], 1000)
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_writes_invalidate_dependent_reads(self):
+        """A budget save drops the ledger but keeps settings and debits"""
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+            self.assertEqual(get_school_debits(1, '2026-2027'), [])
+            get_school_ledger(1, '2026-2027')
+            items = make_budget_items()
+            items[0]['totalAllocation'] = 5.0
+            save_school_budget(1, '2026-2027', {'items': items})
+        with self.app.test_request_context('/'):
+            self.assertEqual(get_school_ledger(1, '2026-2027')[0]['budgeted'], 5.0)
+            get_school_settings(1, '2026-2027')
+            get_school_debits(1, '2026-2027')
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def _cached_reads(self):
+        return [read(1, '2026-2027') for read in (
+            get_school_credits, get_school_credited_by_item, get_school_monthly_summary,
+            get_school_grand_totals, get_school_ledger, get_school_debits)]
+
+    def test_posted_rows_update_cached_reads(self):
+        """Posting and deleting credits and debits patches the cached reads"""
+        credit = {'date': '2026-05-01', 'month': 'May', 'remarks': '', 'lineItems': [
+            {'itemId': 'pow1_row1', 'subItemDescription': 'Item 1', 'code': '221101', 'amount': 300.0},
+            {'itemId': 'pow1_row2', 'subItemDescription': 'Item 2', 'code': '221102', 'amount': 200.0}
+        ]}
+        save_school_credit(1, '2026-2027', dict(credit, date='2026-04-10', month='April'))
+        save_school_debit(1, '2026-2027', {
+            'date': '2026-04-20', 'month': 'April', 'itemId': 'pow1_row1', 'amount': 10.0})
+        with self.app.test_request_context('/'):
+            self._cached_reads()
+            credit_id = save_school_credit(1, '2026-2027', credit)
+            debit_ids = [save_school_debit(1, '2026-2027', {
+                'date': date, 'month': 'May', 'itemId': 'pow1_row1', 'amount': 25.0
+            }) for date in ('2026-05-02', '2026-04-20', '2026-05-02')]
+            delete_school_debit(1, f'debit_{debit_ids[0]}')
+            patched = self._cached_reads()
+        self.assertEqual(patched, self._cached_reads())
+        self.assertEqual(patched[5][0]['id'], f'debit_{debit_ids[2]}')
+
+        with self.app.test_request_context('/'):
+            delete_school_credit(1, f'credit_{credit_id}')
+            patched = self._cached_reads()
+        self.assertEqual(patched, self._cached_reads())
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['invalidations'], 0)
+        self.assertEqual(stats['misses'], 6)
+
+    def test_posted_rows_update_the_first_register_page(self):
+        """The newest page is patched in (date, id) order; other pages are dropped"""
+        def pages():
+            return [get_school_debits_page(1, '2026-2027', 2),
+                    get_school_debits_page(1, '2026-2027', 2, None, None),
+                    get_school_debits_page(1, '2026-2027', 2, ('2026-05-02', 2), None)]
+
+        def debit(date):
+            return save_school_debit(1, '2026-2027', {
+                'date': date, 'month': 'May', 'itemId': 'pow1_row1', 'amount': 5.0})
+
+        first_id = debit('2026-05-01')
+        with self.app.test_request_context('/'):
+            pages()
+            debit('2026-05-02')
+            delete_school_debit(1, f'debit_{first_id}')
+            debit('2026-05-03')
+            debit('2026-04-30')
+            patched = pages()[:2]
+        self.assertEqual(patched, pages()[:2])
+        self.assertEqual(patched[0]['older'], ('2026-05-02', 2))
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['updates'], 8)
+        self.assertEqual(stats['invalidations'], 1)
+
+        with self.app.test_request_context('/'):
+            pages()
+            delete_school_debit(1, 'debit_3')
+            self.assertEqual([d['id'] for d in pages()[0]['rows']], ['debit_2', 'debit_4'])
+
+    def test_least_recently_used_tenant_is_evicted(self):
+        """Only max_tenants schools/years are held"""
+        with self.app.test_request_context('/'):
+            for year in ['2024-2025', '2025-2026', '2026-2027']:
+                get_school_settings(1, year)
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['tenants'], 2)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_least_recently_used_read_of_a_tenant_is_evicted(self):
+        """Each school/year holds at most max_entries reads, however many pages are opened"""
+        tenant_cache.get_tenant_cache().max_entries = 3
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+        for limit in range(1, 6):
+            with self.app.test_request_context('/'):
+                get_school_debits_page(1, '2026-2027', limit)
+                get_school_settings(1, '2026-2027')
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['evictions'], 3)
+        self.assertEqual(stats['hits'], 5)
+
+    def test_reads_from_a_stale_snapshot_are_not_cached(self):
+        """A read that started before a write is not kept after it"""
+        with self.app.test_request_context('/'):
+            get_school_budget(1, '2026-2027')
+            save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 3000})
+            db_session.get_session().conn.execute('BEGIN')
+            db_session.get_session().snapshot_started = 0
+            get_school_settings(1, '2026-2027')
+        self.assertEqual(tenant_cache.get_tenant_cache().stats()['entries'], 1)
+
+    def test_writes_by_other_workers_are_detected(self):
+        """A write committed elsewhere with a version bump drops cached reads"""
+        with self.app.test_request_context('/'):
+            get_school_budget(1, '2026-2027')
+            get_school_settings(1, '2026-2027')
+        def _other_worker(conn):
+            conn.execute("UPDATE school_settings SET total_grant = 7 WHERE school_id = 1")
+            database.bump_tenant_versions(conn.cursor(), 1, ['settings'])
+        database.run_write(_other_worker)
+        with self.app.test_request_context('/'):
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 7)
+            get_school_budget(1, '2026-2027')
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_deleted_school_reads_are_dropped(self):
+        """Reads of a school whose versions were deleted are not served again"""
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+        def _other_worker(conn):
+            conn.execute('DELETE FROM school_settings WHERE school_id = 1')
+            conn.execute('DELETE FROM tenant_versions WHERE school_id = 1')
+        database.run_write(_other_worker)
+        with self.app.test_request_context('/'):
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 0)
+        self.assertEqual(tenant_cache.get_tenant_cache().stats()['invalidations'], 1)
+
+    def test_unchanged_database_skips_version_lookup(self):
+        """PRAGMA data_version answers the check when nothing was committed"""
+        for _ in range(3):
+            with self.app.test_request_context('/'):
+                get_school_settings(1, '2026-2027')
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['version_checks'], 1)
+        self.assertEqual(stats['unchanged_checks'], 2)
+
+    def test_own_writes_do_not_force_a_second_invalidation(self):
+        """Versions bumped by this process become the known versions"""
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+        save_school_settings(1, '2026-2027', {'schoolName': 'Test School', 'totalGrant': 4000})
+        with self.app.test_request_context('/'):
+            self.assertEqual(get_school_settings(1, '2026-2027')['total_grant'], 4000)
+        with self.app.test_request_context('/'):
+            get_school_settings(1, '2026-2027')
+        stats = tenant_cache.get_tenant_cache().stats()
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_cache_unused_outside_requests(self):
+        """Scripts read the database directly"""
+        get_school_settings(1, '2026-2027')
+        self.assertEqual(tenant_cache.get_tenant_cache().stats()['misses'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()